@@ -0,0 +1,269 @@
+import asyncio
+import glob
+import os
+import time
+from argparse import ArgumentParser
+from datetime import datetime as dt
+from datetime import timezone
+from typing import Callable, Dict, List, Optional, Sequence
+
+import orjson
+
+from app.config.setting import settings as s
+from app.db.database import MongoClient
+
+# column types of the parquet files, a column missing from a document is written as null
+STRING, BOOL, TIMESTAMP, STRINGS = "string", "bool", "timestamp", "strings"
+
+
+def month_of(timestamp_ms: Optional[int]) -> str:
+    if timestamp_ms is None:
+        return "unknown"
+    return dt.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).strftime("%Y-%m")
+
+
+def as_strings(value) -> Optional[List[str]]:
+    # `category` / `language` are stored as a string by some tickets and as a list by others
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    return [str(value)]
+
+
+def ticket_deliveries(tickets: List[dict]) -> List[dict]:
+    """
+    One row per chat a ticket was sent to, with the outcome `success` / `failed`, or `pending` before it is approved
+    """
+    rows = []
+    for ticket in tickets:
+        outcomes = {}
+        for chat in ticket.get("chats") or []:
+            outcomes[chat.get("chat_id")] = ("pending", chat)
+        for chat in ticket.get("success_chats") or []:
+            outcomes[chat.get("chat_id")] = ("success", chat)
+        for chat in ticket.get("failed_chats") or []:
+            outcomes[chat.get("chat_id")] = ("failed", chat)
+
+        for chat_id, (outcome, chat) in outcomes.items():
+            rows.append(
+                {
+                    "ticket_id": ticket.get("ticket_id"),
+                    "action": ticket.get("action"),
+                    "chat_id": chat_id,
+                    "chat_name": chat.get("chat_name"),
+                    "outcome": outcome,
+                    "message_id": chat.get("message_id"),
+                    "error": chat.get("error"),
+                    "created_timestamp": ticket.get("created_timestamp"),
+                    "updated_timestamp": ticket.get("updated_timestamp"),
+                }
+            )
+    return rows
+
+
+class AnalyticsTable:
+    """
+    One parquet dataset `<analytics_dir>/<name>`, hive partitioned by the `month` of `created_timestamp`
+    and the `partitions` fields, e.g. `tickets/month=2024-05/action=post_annc/part-*.parquet`.
+    `to_rows` turns a batch of documents into the table rows, the documents themselves by default.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        columns: Dict[str, str],
+        partitions: Sequence[str] = (),
+        to_rows: Callable[[List[dict]], List[dict]] = None,
+    ):
+        self.name = name
+        self.columns = columns
+        self.partitions = tuple(partitions)
+        self.to_rows = to_rows or (lambda documents: documents)
+
+    def schema(self):
+        import pyarrow as pa
+
+        types = {STRING: pa.string(), BOOL: pa.bool_(), STRINGS: pa.list_(pa.string())}
+        types[TIMESTAMP] = pa.timestamp("ms", tz="UTC")
+        return pa.schema([(field, types[kind]) for field, kind in self.columns.items()])
+
+    def to_table(self, rows: List[dict]):
+        import pyarrow as pa
+
+        arrays = []
+        for field in self.schema():
+            kind = self.columns[field.name]
+            values = [row.get(field.name) for row in rows]
+            if kind == STRINGS:
+                values = [as_strings(v) for v in values]
+            elif kind == STRING:
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(pa.array(values, type=field.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema())
+
+    def write(self, root: str, documents: List[dict], part: str) -> int:
+        """
+        Write the rows of `documents` as one new file per partition, returns the number of rows written
+        """
+        import pyarrow.parquet as pq
+
+        groups = {}
+        for row in self.to_rows(documents):
+            key = (month_of(row.get("created_timestamp")),) + tuple(str(row.get(p)) for p in self.partitions)
+            groups.setdefault(key, []).append(row)
+
+        for (month, *values), rows in groups.items():
+            directory = os.path.join(
+                root, self.name, f"month={month}", *(f"{p}={v}" for p, v in zip(self.partitions, values))
+            )
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{part}.parquet")
+            # written under a dot name then renamed, the dataset readers skip files starting with `.` or `_`
+            tmp_path = os.path.join(directory, f".part-{part}.parquet.tmp")
+            pq.write_table(self.to_table(rows), tmp_path)
+            os.replace(tmp_path, path)
+        return sum(len(rows) for rows in groups.values())
+
+    def remove_parts(self, root: str, stem: str) -> int:
+        """
+        Delete the files of every partition written with a part name starting with `stem`, returns how many
+        """
+        paths = glob.glob(os.path.join(glob.escape(root), self.name, "**", f"part-{stem}-*.parquet"), recursive=True)
+        for path in paths:
+            os.remove(path)
+        return len(paths)
+
+
+TICKET_COLUMNS = {
+    "ticket_id": STRING,
+    "status": STRING,
+    "annc_type": STRING,
+    "creator_id": STRING,
+    "creator_name": STRING,
+    "approver_id": STRING,
+    "approver_name": STRING,
+    "category": STRINGS,
+    "language": STRINGS,
+    "label": STRINGS,
+    "content_text": STRING,
+    "old_ticket_id": STRING,
+    "old_content_text": STRING,
+    "new_content_text": STRING,
+    "created_timestamp": TIMESTAMP,
+    "updated_timestamp": TIMESTAMP,
+    "status_changed_timestamp": TIMESTAMP,
+}
+
+DELIVERY_COLUMNS = {
+    "ticket_id": STRING,
+    "chat_id": STRING,
+    "chat_name": STRING,
+    "outcome": STRING,
+    "message_id": STRING,
+    "error": STRING,
+    "created_timestamp": TIMESTAMP,
+    "updated_timestamp": TIMESTAMP,
+}
+
+CHAT_COLUMNS = {
+    "chat_id": STRING,
+    "name": STRING,
+    "chat_type": STRING,
+    "language": STRINGS,
+    "category": STRINGS,
+    "label": STRINGS,
+    "active": BOOL,
+    "description": STRING,
+    "created_timestamp": TIMESTAMP,
+    "updated_timestamp": TIMESTAMP,
+}
+
+# collection -> the tables exported from its documents, the ticket deliveries come from the same cursor as the tickets
+ANALYTICS_SOURCES = {
+    "ticket_records": [
+        AnalyticsTable("tickets", TICKET_COLUMNS, partitions=["action"]),
+        AnalyticsTable("deliveries", DELIVERY_COLUMNS, partitions=["action"], to_rows=ticket_deliveries),
+    ],
+    "chat_info": [AnalyticsTable("chats", CHAT_COLUMNS)],
+}
+
+
+class AnalyticsExporter:
+    """
+    Append the documents updated since the last export to the parquet datasets in `analytics_dir`.
+    The high-water mark of `updated_timestamp` of each collection is kept in `_state.json` and only moved
+    once all its files are written. The files are named after the high-water mark they start from, so the files
+    left by a failed export are deleted by the next one before it writes the same documents again.
+    Documents updated in the last `analytics_lag` seconds wait for the next export, so a write landing with
+    a slightly older timestamp is not skipped.
+    An updated ticket or chat is appended again, its latest row is the one with the highest `updated_timestamp`.
+    """
+
+    def __init__(self, client: MongoClient = None, path: str = None, batch_size: int = None, lag: float = None):
+        self.client = client or MongoClient(s.dev_db if s.is_test else s.prod_db)
+        self.path = path or s.analytics_dir
+        self.batch_size = batch_size or s.analytics_batch_size
+        self.lag = s.analytics_lag if lag is None else lag
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.path, "_state.json")
+
+    def load_state(self) -> dict:
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, "rb") as f:
+            return orjson.loads(f.read())
+
+    def save_state(self, state: dict):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(state, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, self.state_path)
+
+    async def export(self) -> dict:
+        """
+        Export every source collection, returns the rows written per table and the new high-water marks
+        """
+        state = self.load_state()
+        until = int((time.time() - self.lag) * 1000)
+        written = {}
+        for collection, tables in ANALYTICS_SOURCES.items():
+            since = state.get(collection, 0)
+            query = {"updated_timestamp": {"$gt": since, "$lte": until}}
+            await self.client.create_index(collection, [("updated_timestamp", 1)])
+            for table in tables:
+                table.remove_parts(self.path, str(since))
+                written[table.name] = 0
+
+            index = 0
+            async for documents in self.client.iter_batches(
+                collection, query, sort=[("updated_timestamp", 1)], batch_size=self.batch_size
+            ):
+                for table in tables:
+                    # parquet encoding is cpu bound, it runs in a thread so the event loop is not held
+                    part = f"{since}-{index:05d}"
+                    written[table.name] += await asyncio.to_thread(table.write, self.path, documents, part)
+                index += 1
+
+            state[collection] = until
+            self.save_state(state)
+        return {"written": written, "state": state}
+
+
+if __name__ == "__main__":
+    args = ArgumentParser("Export the tickets, deliveries and chats updated since the last run to parquet")
+    args.add_argument("--dir", default=None, help="output directory, `ANALYTICS_DIR` by default")
+    args.add_argument("--batch-size", type=int, default=None, help="documents read and written per batch")
+    args = args.parse_args()
+
+    async def main():
+        exporter = AnalyticsExporter(path=args.dir, batch_size=args.batch_size)
+        try:
+            return await exporter.export()
+        finally:
+            await exporter.client.close()
+
+    print(orjson.dumps(asyncio.run(main()), option=orjson.OPT_INDENT_2).decode())
@@ -1,14 +1,25 @@
+import hashlib
 import uuid
 from datetime import datetime as dt
 
 from pydantic import BaseModel, Field
 
 
+def hash_secret(api_secret: str) -> str:
+    return hashlib.sha256(api_secret.encode()).hexdigest()
+
+
 class APIKey(BaseModel):
     api_key: str
-    api_secret: str
+    api_secret_hash: str  # only the sha256 of the secret is stored, plaintext secret is returned once when created
     name: str
 
+    # token bucket refilled at `rate_limit` requests per second up to `rate_burst`, and at most
+    # `max_concurrency` requests in flight, 0 disables the limit
+    rate_limit: float = 50
+    rate_burst: int = 200
+    max_concurrency: int = 50
+
     created_timestamp: int = Field(default_factory=lambda: int(dt.now().timestamp() * 1000))
 
     @property
@@ -0,0 +1,77 @@
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+from app.auth.models import APIKey
+
+
+class RateLimiter(ABC):
+    """
+    Per key token bucket and in-flight concurrency limiter.
+    State lives in the backend, so a shared store (e.g. redis) can replace `MemoryRateLimiter`
+    to apply the same quota across uvicorn workers.
+    """
+
+    @abstractmethod
+    async def acquire(self, key: APIKey) -> float:
+        """
+        Try to start a request for the key, return 0 when allowed,
+        otherwise the number of seconds the caller should wait before retrying
+        """
+
+    @abstractmethod
+    async def release(self, key: APIKey):
+        """
+        Mark a request started with a successful `acquire` as finished
+        """
+
+    @abstractmethod
+    async def get_stats(self) -> dict:
+        """
+        Allowed and limited request counters and in-flight requests of each key
+        """
+
+
+class MemoryRateLimiter(RateLimiter):
+    def __init__(self):
+        self.buckets = {}  # key name -> (tokens, last refill time)
+        self.in_flight = defaultdict(int)
+        self.counters = defaultdict(lambda: {"allowed": 0, "rate_limited": 0, "concurrency_limited": 0})
+
+    def take_token(self, key: APIKey) -> float:
+        if not key.rate_limit:
+            return 0
+
+        now = time.monotonic()
+        tokens, last = self.buckets.get(key.name, (key.rate_burst, now))
+        tokens = min(key.rate_burst, tokens + (now - last) * key.rate_limit)
+        if tokens < 1:
+            self.buckets[key.name] = (tokens, now)
+            return (1 - tokens) / key.rate_limit
+
+        self.buckets[key.name] = (tokens - 1, now)
+        return 0
+
+    async def acquire(self, key: APIKey) -> float:
+        counter = self.counters[key.name]
+        if key.max_concurrency and self.in_flight[key.name] >= key.max_concurrency:
+            counter["concurrency_limited"] += 1
+            return 1
+
+        retry_after = self.take_token(key)
+        if retry_after:
+            counter["rate_limited"] += 1
+            return retry_after
+
+        counter["allowed"] += 1
+        self.in_flight[key.name] += 1
+        return 0
+
+    async def release(self, key: APIKey):
+        self.in_flight[key.name] = max(self.in_flight[key.name] - 1, 0)
+
+    async def get_stats(self) -> dict:
+        return {name: {**counter, "in_flight": self.in_flight[name]} for name, counter in self.counters.items()}
+
+
+limiter: RateLimiter = MemoryRateLimiter()
@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 
-from app.auth.services import create_api_key
+from app.auth import rate_limit
+from app.auth.services import create_api_key, verify_api_key
+from app.responses import FastJSONResponse
 
 router = APIRouter()
 
@@ -10,6 +12,15 @@ async def create_api_key_route(name: str):
     inputs = {"name": name}
     try:
         res = await create_api_key(**inputs)
-        return {"status": 1, "data": res}
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error when creating api key: {e}")
+
+
+@router.get("/usage", dependencies=[Depends(verify_api_key)])
+async def get_usage_route():
+    try:
+        res = await rate_limit.limiter.get_stats()
+        return FastJSONResponse({"status": 1, "data": res})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting api key usage: {e}")
@@ -1,9 +1,11 @@
+import hmac
 import secrets
 
+from cachetools import TTLCache
 from fastapi import HTTPException, Security
 from fastapi.security.api_key import APIKeyHeader
 
-from app.auth.models import APIKey
+from app.auth.models import APIKey, hash_secret
 from app.config.setting import settings as s
 from app.db.database import MongoClient
 
@@ -13,8 +15,22 @@ collections = "keys"
 API_KEY_HEADER = APIKeyHeader(name="X-API-KEY")
 API_SECRET_HEADER = APIKeyHeader(name="X-API-SECRET")
 
+# api_key -> APIKey of keys already loaded from the db
+key_cache = TTLCache(maxsize=s.api_key_cache_size, ttl=s.api_key_cache_ttl)
 
-async def create_api_key(name: str) -> APIKey:
+
+def invalidate_api_key_cache(api_key: str = None):
+    """
+    Drop one key from the validated key cache, or the whole cache when no key is given.
+    Must be called whenever a key is created, revoked or changed.
+    """
+    if api_key is None:
+        key_cache.clear()
+    else:
+        key_cache.pop(api_key, None)
+
+
+async def create_api_key(name: str) -> dict:
 
     # check whether the key name is already exists
     res = await client.find_one(collections, query={"name": name})
@@ -23,18 +39,72 @@ async def create_api_key(name: str) -> APIKey:
 
     api_key = secrets.token_hex(16)
     api_secret = secrets.token_hex(32)
-    key = APIKey(api_key=api_key, api_secret=api_secret, name=name)
+    key = APIKey(api_key=api_key, api_secret_hash=hash_secret(api_secret), name=name)
     await client.insert_one(collections, key.model_dump())
-    return key.model_dump()
+    invalidate_api_key_cache(api_key)
 
+    # secret is only returned here, the db only keeps the hash
+    return {"api_key": api_key, "api_secret": api_secret, "name": name, "created_timestamp": key.created_timestamp}
 
-async def validate_api_key(api_key: str, api_secret: str) -> bool:
+
+async def revoke_api_key(name: str) -> dict:
+    key = await client.find_one(collections, query={"name": name})
+    if not key:
+        raise HTTPException(status_code=400, detail=f"Key not found with name: `{name}`")
+
+    status = await client.delete_one(collections, query={"name": name})
+    invalidate_api_key_cache(key["api_key"])
+    return {"delete_status": status}
+
+
+async def load_api_key(api_key: str) -> APIKey:
+    """
+    Keys created before secrets were hashed still have a plaintext `api_secret`,
+    it is replaced with `api_secret_hash` the first time the key is used.
+    """
     key = await client.find_one(collections, query={"api_key": api_key})
     if not key:
-        return False
-    if key["api_secret"] != api_secret:
-        return False
-    return True
+        return None
+
+    if "api_secret_hash" not in key:
+        key = await client.update_one(
+            collections,
+            query={"api_key": api_key},
+            update={"api_secret_hash": hash_secret(key["api_secret"])},
+            unset=["api_secret"],
+        )
+    return APIKey(**key)
+
+
+async def prime_api_key_cache() -> int:
+    """
+    Load the hashed keys into the cache at startup, so the first request of each key skips the db lookup
+    """
+    keys = await client.find_many(collections, query={"api_secret_hash": {"$exists": True}}, limit=s.api_key_cache_size)
+    for key in keys:
+        key_cache[key["api_key"]] = APIKey(**key)
+    return len(keys)
+
+
+async def get_api_key(api_key: str, api_secret: str) -> APIKey:
+    """
+    Return the key when the secret matches, otherwise None
+    """
+    if not api_key or not api_secret:
+        return None
+
+    key = key_cache.get(api_key)
+    if key is None:
+        key = await load_api_key(api_key)
+        if not key:
+            return None
+        key_cache[api_key] = key
+
+    return key if hmac.compare_digest(key.api_secret_hash, hash_secret(api_secret)) else None
+
+
+async def validate_api_key(api_key: str, api_secret: str) -> bool:
+    return await get_api_key(api_key, api_secret) is not None
 
 
 async def verify_api_key(api_key: str = Security(API_KEY_HEADER), api_secret: str = Security(API_SECRET_HEADER)):
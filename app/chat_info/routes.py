@@ -1,16 +1,21 @@
 from typing import List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 
 from app.auth.services import verify_api_key
 from app.chat_info.models import Chat, ChatInfoParams, DeleteChatInfo, UpdateChatInfo
 from app.chat_info.services import (
     create_chat,
     delete_chat,
+    get_chat_facets,
     get_chat_info,
+    get_chat_info_etag,
     update_chat_dashboard,
     update_chat_info,
 )
+from app.dashboard import sync as dashboard_sync
+from app.db.dashboard import DashboardMode
+from app.responses import FastJSONResponse, not_modified
 
 router = APIRouter(dependencies=[Depends(verify_api_key)])
 
@@ -19,6 +24,7 @@ router = APIRouter(dependencies=[Depends(verify_api_key)])
 
 @router.get("/info")
 async def get_chat_info_route(
+    request: Request,
     chat_id: Optional[Union[list[str], str]] = Query(None),
     name: Optional[Union[list[str], str]] = Query(None),
     chat_type: Optional[str] = Query(None),
@@ -39,29 +45,50 @@ async def get_chat_info_route(
         active=active,
     )
     try:
-        res = await get_chat_info(params)
-        return {"status": 1, "data": res}
+        # version is read before the data, so a concurrent write can only make the etag older than the data
+        etag = await get_chat_info_etag()
+        if response := not_modified(request, etag):
+            return response
+        res = await get_chat_info(params, version=etag)
+        return FastJSONResponse({"status": 1, "data": res}, headers={"ETag": etag})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting chat info: {str(e)}, params: {params.model_dump()}")
 
 
+@router.get("/facets")
+async def get_chat_facets_route(request: Request, active: Optional[bool] = True):
+    try:
+        etag = await get_chat_info_etag()
+        if response := not_modified(request, etag):
+            return response
+        res = await get_chat_facets(active)
+        return FastJSONResponse({"status": 1, "data": res}, headers={"ETag": etag})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting chat facets: {str(e)}")
+
+
 @router.get("/update_dashboard")
-async def update_dashboard_route(direction: str):
+async def update_dashboard_route(direction: str, mode: DashboardMode = DashboardMode.full, background: bool = False):
     try:
-        res = await update_chat_dashboard(direction)
-        return {"status": 1, "data": res}
+        job = dashboard_sync.jobs["chats"]
+        if background:
+            return FastJSONResponse({"status": 1, "data": job.mark_dirty(direction)})
+        async with job.syncing():
+            res = await update_chat_dashboard(direction, mode=mode)
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating chat dashboard: {str(e)}")
 
 
 # below are post routes
 
+
 # create new chat
 @router.post("/create")
 async def create_chat_route(chat: Chat):
     try:
         res = await create_chat(chat)
-        return {"status": 1, "data": res}
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating chat: {str(e)}, chat: {chat.model_dump()}")
 
@@ -70,7 +97,7 @@ async def create_chat_route(chat: Chat):
 async def update_chat_route(params: UpdateChatInfo):
     try:
         res = await update_chat_info(params)
-        return {"status": 1, "data": res}
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating chat: {str(e)}, chat: {params.model_dump()}")
 
@@ -79,6 +106,6 @@ async def update_chat_route(params: UpdateChatInfo):
 async def delete_chat_route(params: DeleteChatInfo):
     try:
         res = await delete_chat(params)
-        return {"status": 1, "data": res}
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting chat: {str(e)}, chat: {params.model_dump()}")
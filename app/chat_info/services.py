@@ -1,14 +1,47 @@
-import pandas as pd
+import time
+from typing import List
+
 from fastapi import HTTPException
 
 from app.chat_info.models import Chat, ChatInfoParams, DeleteChatInfo, UpdateChatInfo
 from app.config.setting import settings as s
-from app.db.dashboard import GCClient
+from app.db.dashboard import (
+    AsyncGCClient,
+    DashboardMode,
+    dashboard_output,
+    summarize_table,
+)
 from app.db.database import MongoClient
+from app.db.single_flight import SingleFlight, params_key
+from app.responses import make_etag
 
 client = MongoClient(s.dev_db if s.is_test else s.prod_db)
 collection = "chat_info"
-gc_client = GCClient()
+gc_client = AsyncGCClient()
+
+# concurrent identical `/chats/info` queries share one db call
+info_flight = SingleFlight("chat_info")
+
+# facets computed from `chat_info`, keyed by `active` and dropped whenever a chat is written
+facets_cache = {}
+facet_fields = ["category", "language", "label", "name"]
+
+# revision of the chat sheet and version of `chat_info` at the last successful pull,
+# a pull without changes to either since then is skipped
+last_pull = {"modified_time": None, "digest": None, "version": None}
+
+
+async def chat_info_changed() -> str:
+    """
+    Called after every write to `chat_info`, drops the cached facets and bumps the collection version, returns it
+    """
+    facets_cache.clear()
+    info_flight.invalidate()
+    return await client.bump_version(collection)
+
+
+async def get_chat_info_etag() -> str:
+    return make_etag(collection, await client.get_version(collection))
 
 
 async def create_chat(chat: Chat):
@@ -18,15 +51,18 @@ async def create_chat(chat: Chat):
             raise HTTPException(status_code=400, detail=f"Chat already exists with id `{chat.chat_id}`")
         else:
             return await update_chat_info(UpdateChatInfo(chat_id=chat.chat_id, active=True))
-    return await client.insert_one(collection, chat.model_dump())
+    res = await client.insert_one(collection, chat.model_dump())
+    await chat_info_changed()
+    return res
 
 
-async def get_chat_info(params: ChatInfoParams):
+async def get_chat_info(params: ChatInfoParams, version: str = None):
     """
     Query params have the following case:
     1. `chat_id`, `name` won't combine with other params
     2. `chat_type`, `language`, `category`, `label` can combine with `num`
         and logic will be `OR` between params and `AND` within each param
+    `version` is the collection version the caller read, only a query started at that version is joined
     """
     query = {}
     if params.chat_id is not None:
@@ -52,7 +88,31 @@ async def get_chat_info(params: ChatInfoParams):
     if params.active is not None:
         query["active"] = params.active
 
-    return await client.find_many(collection, query=query, limit=params.num)
+    return await info_flight.do(
+        f"{version}:{params_key(params)}", lambda: client.find_many(collection, query=query, limit=params.num)
+    )
+
+
+async def get_chat_facets(active: bool = True):
+    """
+    Return the distinct `category`, `language`, `label` and `name` values with the number of chats having each one.
+    The result is computed in one aggregation and cached in process until `chat_info` is changed by this service.
+    """
+    if active in facets_cache:
+        return facets_cache[active]
+
+    facet_stages = {}
+    for field in facet_fields:
+        stages = [{"$unwind": f"${field}"}] if field != "name" else []
+        stages += [{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}, {"$sort": {"_id": 1}}]
+        facet_stages[field] = stages
+
+    pipeline = [{"$match": {"active": active} if active is not None else {}}, {"$facet": facet_stages}]
+    res = await client.aggregate(collection, pipeline)
+    facets = {field: {i["_id"]: i["count"] for i in res[0][field]} for field in facet_fields}
+
+    facets_cache[active] = facets
+    return facets
 
 
 async def update_chat_info(params: UpdateChatInfo):
@@ -62,21 +122,74 @@ async def update_chat_info(params: UpdateChatInfo):
 
     chat = Chat(**chat_data)
     chat.update(params)
-    return await client.update_one(collection, query={"chat_id": params.chat_id}, update=chat.model_dump())
+    res = await client.update_one(collection, query={"chat_id": params.chat_id}, update=chat.model_dump())
+    await chat_info_changed()
+    return res
 
 
 async def delete_chat(params: DeleteChatInfo):
     status = await client.delete_one(collection, query={"chat_id": params.chat_id})
+    await chat_info_changed()
 
     return {"delete_status": status}
 
 
-async def update_chat_dashboard(direction: str = "pull", **kwargs):
+def plan_chat_pull(header: List[str], rows: List[List[str]], chats: List[dict]) -> tuple:
+    """
+    Join the sheet rows to the db chats by name, through an index built once (the first row of a name wins).
+    The dashboard can only change language, category, label and description, only chats where one of them differs
+    are returned, as `(query, update)` pairs for `bulk_update` and the updated chats.
+    """
+    column = {title: i for i, title in reversed(list(enumerate(header)))}
+    description = column.get("Description")
+    # category columns sit between Label and Description
+    categories = [
+        (i, header[i].replace(" ", "_").lower()) for i in range(column["Label"] + 1, description or len(header))
+    ]
+    sheet_chats = {}
+    for row in rows:
+        sheet_chats.setdefault(row[column["Name"]], row)
+
+    updates, results, missing = [], [], []
+    for data in chats:
+        row = sheet_chats.get(data["name"])
+        if row is None:
+            missing.append(data["name"])
+            continue
+        new_data = {
+            "language": row[column["Language"]].split(", ") if row[column["Language"]] else [],
+            "category": [cat for i, cat in categories if row[i] == "V"],
+            "label": row[column["Label"]].split(", ") if row[column["Label"]] else [],
+            "description": row[description] if description is not None else "",
+        }
+        # an unset field in the db equals an empty cell
+        if all((data.get(field) or type(value)()) == value for field, value in new_data.items()):
+            continue
+
+        chat = Chat(**data)
+        chat.update(UpdateChatInfo(chat_id=chat.chat_id, **new_data))
+        update = chat.model_dump()
+        updates.append(({"chat_id": chat.chat_id}, update))
+        results.append(update)
+    if missing:
+        print(f"No matching records found for {len(missing)} chats: {', '.join(missing[:10])}")
+    return updates, results
+
+
+async def update_chat_dashboard(direction: str = "pull", mode: DashboardMode = DashboardMode.full, **kwargs):
     """
     This function will pull or push chat info to the google sheet,
     1. push is using when chat name, chat type, new chat created, deleted chat status changed
     2. pull is using whenever a user request to create a ticket, update the category, language, label on the dashboard to mongodb
+    `summary` mode only returns row count and digest instead of the rows
     """
+    import pandas as pd
+
+    start = time.perf_counter()
+
+    def output(table):
+        return dashboard_output(table, mode, start)
+
     fixed_columns_map = {
         "name": "Name",
         "chat_type": "Type",
@@ -87,10 +200,10 @@ async def update_chat_dashboard(direction: str = "pull", **kwargs):
         "description": "Description",
     }
     if direction == "push":
-        ws = gc_client.get_ws(name="TG Chat Info", to_type="ws")
-        chat_info = pd.DataFrame(await client.find_many(collection, query={"active": True}))[
-            list(fixed_columns_map.keys())
-        ].rename(columns=fixed_columns_map)
+        ws = await gc_client.get_ws(name="TG Chat Info", to_type="ws")
+        chat_info = pd.DataFrame(
+            await client.find_many(collection, query={"active": True}), columns=list(fixed_columns_map.keys())
+        ).rename(columns=fixed_columns_map)
 
         chat_info["Label"] = chat_info["Label"].apply(lambda x: ", ".join(x) if x else "")
         chat_info["Language"] = chat_info["Language"].apply(lambda x: ", ".join(x) if x else "")
@@ -104,66 +217,52 @@ async def update_chat_dashboard(direction: str = "pull", **kwargs):
         chat_info["Added Time"] = pd.to_datetime(chat_info["Added Time"], unit="ms")
         chat_info["Description"] = chat_info.pop("Description").fillna("")
 
-        # start writing to the google sheet
-        dashboard = ws.get_as_df()[["Name", "Type"]]
-        dashboard["sort"] = range(len(dashboard))
-        chat_info = (
-            chat_info.merge(dashboard, on=["Name", "Type"], how="left")
-            .sort_values("sort", na_position="last")
-            .drop(columns="sort")
-        )
+        # start writing to the google sheet, chats keep their row and new chats go to the bottom.
+        # a new or emptied sheet has no rows to keep
+        values = await gc_client.get_values(ws)
+        order = {}
+        if values and {"Name", "Type"} <= set(values[0]):
+            name, chat_type = values[0].index("Name"), values[0].index("Type")
+            for i, row in enumerate(values[1]):
+                order.setdefault((row[name], row[chat_type]), i)
+        chat_info["sort"] = [order.get(key, float("nan")) for key in zip(chat_info["Name"], chat_info["Type"])]
+        chat_info = chat_info.sort_values("sort", na_position="last", kind="stable").drop(columns="sort")
 
-        ws.clear()
-        ws.set_dataframe(chat_info, start="A1", copy_index=False, copy_head=True)
+        await gc_client.sync_dataframe(ws, chat_info, keys=["Name", "Type"])
 
-        return chat_info.to_dict(orient="records")
+        return output(chat_info)
     elif direction == "pull":
         """
         Pull is using to update the online record to the mongo db.
         Category is the column between Description and Label
         """
-        chat_info = gc_client.get_ws(name="TG Chat Info", to_type="df")  # .drop(columns=[""])
-        if "Description" not in chat_info.columns:
-            chat_info["Description"] = ""
-
-        category = list(chat_info.columns)[
-            chat_info.columns.get_loc("Label") + 1 : chat_info.columns.get_loc("Description")
-        ]
-
-        chat_info["Category"] = chat_info.apply(
-            lambda x: [cat.replace(" ", "_").lower() for cat in category if x[cat] == "V"], axis=1
-        )
-        chat_info["Label"] = chat_info["Label"].apply(lambda x: x.split(", ") if x else [])
-        chat_info["Language"] = chat_info["Language"].apply(lambda x: x.split(", ") if x else [])
+        # read before the values and the chats, so an edit made during the pull is seen by the next one.
+        # a chat written in the db since the last pull may differ from the sheet again, even on an unchanged sheet
+        modified_time = await gc_client.get_modified_time()
+        version = await client.get_version(collection)
+        if modified_time == last_pull["modified_time"] and version == last_pull["version"]:
+            return output([])
 
-        reverse_columns_map = {v: k for k, v in fixed_columns_map.items()}
-        chat_info = chat_info.rename(columns=reverse_columns_map)
-        chat_info_db = await client.find_many(collection, query={"active": True})
+        ws = await gc_client.get_ws(name="TG Chat Info", to_type="ws")
+        values = await gc_client.get_values(ws) if ws is not None else None
+        if not values:
+            raise ValueError("`TG Chat Info` sheet is missing or empty")
 
-        # combine the chat info from the google sheet and the mongo db
+        # the spreadsheet also changes with the ticket and user sheets, the chat sheet itself may be unchanged
         results = []
-        for data in chat_info_db:
-            chat = Chat(**data)
-            filtered_data = chat_info[chat_info["name"] == chat.name].to_dict(orient="records")
-
-            if not filtered_data:
-                print(f"No matching records found for chat.name: {chat.name}")
-                continue    
-            new_data = filtered_data[0]
-            # dashboard can only update the category, language, label
-            chat.update(
-                UpdateChatInfo(
-                    chat_id=chat.chat_id,
-                    language=new_data["language"],
-                    category=new_data["category"],
-                    label=new_data["label"],
-                    description=new_data["description"],
-                )
-            )
-
-            results.append(
-                await client.update_one(collection, query={"chat_id": chat.chat_id}, update=chat.model_dump())
-            )
-        return results
+        header, rows = values
+        digest = summarize_table([header] + rows)["digest"]
+        if digest != last_pull["digest"] or version != last_pull["version"]:
+            chat_info_db = await client.find_many(collection, query={"active": True})
+            updates, results = plan_chat_pull(header, rows, chat_info_db)
+            await client.bulk_update(collection, updates)
+            if updates:
+                bumped = await chat_info_changed()
+                # the pull's own write needs no pull again, unless another write landed since `version` was read
+                epoch, number = version.rsplit("-", 1)
+                if bumped == f"{epoch}-{int(number) + 1}":
+                    version = bumped
+        last_pull.update(modified_time=modified_time, digest=digest, version=version)
+        return output(results)
     else:
         raise HTTPException(status_code=400, detail=f"Invalid direction: {direction}. Only `pull` or `push` is allowed")
@@ -0,0 +1,139 @@
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, only gzip is offered without it
+    brotli = None
+
+
+class GZipCompressor:
+    def __init__(self, level: int):
+        # wbits 31 writes the gzip container
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, quality: int):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.finish()
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """
+    Pick `br` or `gzip` from the `Accept-Encoding` header by q-value, brotli wins a tie
+    """
+    offered = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+
+    candidates = [("br", offered.get("br", 0))] if brotli else []
+    candidates.append(("gzip", offered.get("gzip", 0)))
+    encoding, q = max(candidates, key=lambda x: x[1])
+    return encoding if q > 0 else None
+
+
+class CompressionMiddleware:
+    """
+    Negotiated gzip / brotli compression of responses bigger than `minimum_size` bytes
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1000, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            encoding = choose_encoding(Headers(scope=scope).get("Accept-Encoding", ""))
+            if encoding:
+                compressor = (
+                    BrotliCompressor(self.brotli_quality) if encoding == "br" else GZipCompressor(self.gzip_level)
+                )
+                responder = CompressionResponder(self.app, self.minimum_size, encoding, compressor)
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, minimum_size: int, encoding: str, compressor):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoding = encoding
+        self.compressor = compressor
+        self.send: Send = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # hold the headers until the first body chunk tells whether to compress
+            self.initial_message = message
+            self.passthrough = "content-encoding" in Headers(raw=message["headers"])
+            return
+
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            if self.passthrough or (len(body) < self.minimum_size and not more_body):
+                self.passthrough = True
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            body = self.compressor.compress(body)
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                body += self.compressor.flush()
+                headers["Content-Length"] = str(len(body))
+            message["body"] = body
+            await self.send(self.initial_message)
+            await self.send(message)
+            return
+
+        if self.passthrough:
+            await self.send(message)
+            return
+
+        body = self.compressor.compress(body)
+        if not more_body:
+            body += self.compressor.flush()
+        message["body"] = body
+        await self.send(message)
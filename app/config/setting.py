@@ -8,10 +8,69 @@ class Settings(BaseSettings):
     dev_db: str
     command_bot_token: str
     event_bot_token: str
-    gc_config_path: str
-    dashboard_url: str
+    gc_config_path: str = ""  # only read by the `sheets` dashboard backend
+    dashboard_url: str = ""
     is_test: bool = False
 
+    # validated api keys are cached in process to skip the `keys` lookup on every request
+    api_key_cache_size: int = 1024
+    api_key_cache_ttl: int = 300  # seconds
+
+    # request bodies over this length are truncated in the log and only logged for a sample of requests
+    log_body_max_length: int = 1000
+    log_large_body_sample_rate: float = 0.1
+
+    # responses over `compression_minimum_size` bytes are compressed with brotli or gzip, as the client accepts
+    compression_minimum_size: int = 1000
+    gzip_level: int = 6
+    brotli_quality: int = 5
+
+    # finished spans are written to `app/logs/traces.jsonl` (`file`), posted to an otlp/http collector (`otlp`)
+    # or dropped (`none`), the trace id is returned in the `X-Request-ID` response header
+    trace_exporter: str = "file"
+    # the trace file is rotated once it reaches `trace_file_max_bytes`, keeping `trace_file_backups` older files
+    trace_file_max_bytes: int = 50 * 2**20
+    trace_file_backups: int = 3
+    otlp_endpoint: str = "http://localhost:4318"
+
+    # requests sending `X-Profile: <profiling_token>`, and a `profiling_sample_rate` share of all requests,
+    # are profiled and saved to `app/profiles`, listed and downloaded from `/debug/profiles`
+    profiling_token: str = ""
+    profiling_sample_rate: float = 0.0
+    profiling_interval: float = 0.001  # seconds between samples
+    profiling_max_files: int = 50
+
+    # a failed startup warm-up is retried after `warm_up_retry_delay` seconds, doubled after each failure
+    # up to `warm_up_max_retry_delay`
+    warm_up_retry_delay: float = 1.0
+    warm_up_max_retry_delay: float = 60.0
+
+    # the event loop lag is sampled every `loop_lag_interval` seconds, the stack of the loop thread is logged
+    # when it is blocked for longer than `loop_block_threshold` seconds
+    loop_lag_interval: float = 0.1
+    loop_block_threshold: float = 0.5
+
+    # spreadsheet and worksheet handles are reused for this long before fetching the metadata again
+    sheets_handle_ttl: int = 600  # seconds
+    # sheets calls run in a pool of `sheets_max_workers` threads shared by the services, reads are given up on
+    # after `sheets_timeout` seconds, writes are always waited for
+    sheets_max_workers: int = 4
+    sheets_timeout: float = 60.0  # seconds
+    # dashboard syncs requested with `background=true` are coalesced into one sync per dashboard per window
+    dashboard_sync_window: float = 30.0  # seconds
+    # on shutdown the pending syncs run right away, the ones not done after this long are dropped
+    dashboard_shutdown_timeout: float = 20.0  # seconds
+    # `sheets` writes the dashboards to the google spreadsheet at `dashboard_url`, `local` writes every worksheet
+    # to a `dashboard_local_format` (csv / parquet) file in `dashboard_local_dir` instead
+    dashboard_backend: str = "sheets"
+    dashboard_local_dir: str = "app/dashboard_data"
+    dashboard_local_format: str = "csv"
+    # `python -m app.analytics` appends the documents updated since its last run to parquet files in `analytics_dir`,
+    # reading `analytics_batch_size` documents at a time and leaving the last `analytics_lag` seconds for the next run
+    analytics_dir: str = "app/analytics_data"
+    analytics_batch_size: int = 5000
+    analytics_lag: float = 60.0  # seconds
+
     model_config = ConfigDict(env_file="app/.env", env_file_encoding="utf-8")
 
 
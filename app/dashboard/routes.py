@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from app.auth.services import verify_api_key
+from app.dashboard.sync import get_status
+from app.responses import FastJSONResponse
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.get("/status")
+async def get_status_route():
+    try:
+        return FastJSONResponse({"status": 1, "data": get_status()})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting dashboard sync status: {e}")
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager, suppress
+from typing import Awaitable, Callable, Tuple
+
+from app.chat_info.services import update_chat_dashboard
+from app.config.setting import settings as s
+from app.db.dashboard import DashboardMode
+from app.tickets.services import update_ticket_dashboard
+from app.users.services import update_user_dashboard
+
+
+class DashboardJob:
+    """
+    Sync of one dashboard, fed with "dirty" signals. The first signal schedules a sync `window` seconds later and
+    the signals arriving meanwhile join it, so a burst of changes costs one sync. Syncs of the same dashboard,
+    queued or requested directly, never overlap. `steps` are the kinds of sync the dashboard has, the pending
+    ones run in that order. `flush` runs the pending steps without waiting for the window, e.g. on shutdown.
+    """
+
+    def __init__(self, name: str, sync: Callable[[str], Awaitable], window: float, steps: Tuple[str, ...] = ("sync",)):
+        self.name = name
+        self.sync = sync
+        self.window = window
+        self.steps = steps
+        self.pending = set()
+        # steps of the queued sync in progress
+        self.running = []
+        self.task = None
+        self.lock = asyncio.Lock()
+        # set by `flush` to end the wait for the window, one per task as it is bound to the running loop
+        self.wake = None
+        self.signals = 0
+        self.syncs = 0
+        self.last_sync = None
+        self.last_duration_ms = None
+        self.last_error = None
+
+    def mark_dirty(self, step: str = "sync") -> dict:
+        if step not in self.steps:
+            raise ValueError(f"Invalid step `{step}` for the {self.name} dashboard, valid steps are {self.steps}")
+        self.pending.add(step)
+        self.signals += 1
+        if self.task is None or self.task.done():
+            self.wake = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+        return self.status()
+
+    async def run(self):
+        while self.pending:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.wake.wait(), timeout=self.window)
+            self.running = [step for step in self.steps if step in self.pending]
+            self.pending.clear()
+            try:
+                async with self.syncing():
+                    for step in self.running:
+                        await self.sync(step)
+            except Exception:
+                logging.getLogger("main").exception(f"Sync of the {self.name} dashboard failed")
+            finally:
+                self.running = []
+
+    async def flush(self):
+        """
+        Run the pending steps now and wait for them
+        """
+        if self.task is None or self.task.done():
+            return
+        self.wake.set()
+        await asyncio.wait([self.task])
+
+    @asynccontextmanager
+    async def syncing(self):
+        async with self.lock:
+            start = time.perf_counter()
+            try:
+                yield
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            finally:
+                self.syncs += 1
+                self.last_sync = time.time()
+                self.last_duration_ms = round((time.perf_counter() - start) * 1000, 3)
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            dropped = self.running + [step for step in self.steps if step in self.pending]
+            if dropped:
+                logging.getLogger("main").warning(
+                    f"Cancelled the {dropped} steps of the queued {self.name} dashboard sync"
+                )
+        self.pending.clear()
+
+    def status(self) -> dict:
+        return {
+            "pending": [step for step in self.steps if step in self.pending],
+            "running": self.lock.locked(),
+            "signals": self.signals,
+            "syncs": self.syncs,
+            "last_sync": self.last_sync,
+            "last_duration_ms": self.last_duration_ms,
+            "last_error": self.last_error,
+        }
+
+
+jobs = {
+    "users": DashboardJob("users", lambda step: update_user_dashboard(DashboardMode.summary), s.dashboard_sync_window),
+    "tickets": DashboardJob(
+        "tickets", lambda step: update_ticket_dashboard(DashboardMode.summary), s.dashboard_sync_window
+    ),
+    # human edits on the sheet are pulled into mongo before a push overwrites the sheet
+    "chats": DashboardJob(
+        "chats",
+        lambda step: update_chat_dashboard(step, mode=DashboardMode.summary),
+        s.dashboard_sync_window,
+        steps=("pull", "push"),
+    ),
+}
+
+
+def get_status() -> dict:
+    return {name: job.status() for name, job in jobs.items()}
+
+
+def cancel_all():
+    for job in jobs.values():
+        job.cancel()
+
+
+async def flush_all(timeout: float):
+    """
+    On shutdown, run the pending syncs right away instead of dropping them. The syncs still running after
+    `timeout` seconds are cancelled, the dropped steps are logged.
+    """
+    with suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(asyncio.gather(*[job.flush() for job in jobs.values()]), timeout=timeout)
+    cancel_all()
@@ -1,27 +1,506 @@
-from typing import Union
+from __future__ import annotations
 
-import pandas as pd
-import pygsheets as pg
+import asyncio
+import contextvars
+import functools
+import hashlib
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from enum import Enum
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+
+import orjson
 
 from app.config.setting import settings as s
+from app.metrics.registry import SHEETS_OPERATION_LATENCY
+from app.tracing import span
+
+if TYPE_CHECKING:  # pandas and pygsheets take most of the import time, they are imported on first use
+    import pandas as pd
+    import pygsheets as pg
+
+
+class DashboardMode(str, Enum):
+    full = "full"  # return every exported row
+    summary = "summary"  # return row count and digest only
+
+
+def summarize_table(table: Union[pd.DataFrame, List[dict]]) -> dict:
+    """
+    Row count and a digest of the exported content, the digest only changes when the content changes
+    """
+    if isinstance(table, list):
+        content = orjson.dumps(table, option=orjson.OPT_SORT_KEYS, default=str)
+    else:
+        import pandas as pd
+
+        content = pd.util.hash_pandas_object(table.astype(str), index=False).values.tobytes()
+    return {"rows": len(table), "digest": hashlib.sha256(content).hexdigest()[:16]}
+
+
+@contextmanager
+def observe(operation: str):
+    # every sheets call is timed and recorded as a span of the current request
+    with span(f"sheets.{operation}"):
+        with SHEETS_OPERATION_LATENCY.time(operation=operation):
+            yield
+
+
+def elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+def dashboard_output(table: Union[pd.DataFrame, List[dict]], mode: DashboardMode, start: float = None):
+    """
+    The exported rows, or in `summary` mode their count and digest, with `duration_ms` since the `start` perf counter
+    """
+    if mode == DashboardMode.summary:
+        output = summarize_table(table)
+        if start is not None:
+            output["duration_ms"] = elapsed_ms(start)
+        return output
+    return table if isinstance(table, list) else table.to_dict(orient="records")
+
+
+def diff_rows(old_rows: List[list], new_rows: List[list], key_index: List[int]) -> Optional[dict]:
+    """
+    Indexes of the rows to delete (in `old_rows`), insert and overwrite (in `new_rows`), rows are matched by key.
+    None when the keys are not unique or the rows kept from `old_rows` changed their order.
+    """
+    old_keys = [tuple(row[i] for i in key_index) for row in old_rows]
+    new_keys = [tuple(row[i] for i in key_index) for row in new_rows]
+    old_set, new_set = set(old_keys), set(new_keys)
+    if len(old_set) != len(old_keys) or len(new_set) != len(new_keys):
+        return None
+    if [k for k in old_keys if k in new_set] != [k for k in new_keys if k in old_set]:
+        return None
+
+    old_by_key = dict(zip(old_keys, old_rows))
+    return {
+        "deleted": [i for i, k in enumerate(old_keys) if k not in new_set],
+        "inserted": [i for i, k in enumerate(new_keys) if k not in old_set],
+        "changed": [i for i, k in enumerate(new_keys) if k in old_set and old_by_key[k] != new_rows[i]],
+    }
+
+
+def dataframe_rows(df: pd.DataFrame) -> Tuple[List[str], List[list]]:
+    """
+    Header and rows of a DataFrame as cell text, missing values (None, NaN, NaT) are empty like the cells read back
+    """
+    return [str(c) for c in df.columns], df.astype(str).where(df.notna(), "").values.tolist()
+
+
+def to_runs(indexes: List[int]) -> List[Tuple[int, int]]:
+    """
+    Contiguous `[start, end)` runs of sorted indexes
+    """
+    runs = []
+    for i in indexes:
+        if runs and runs[-1][1] == i:
+            runs[-1][1] = i + 1
+        else:
+            runs.append([i, i + 1])
+    return [tuple(run) for run in runs]
 
 
-class GCClient:
+class DashboardBackend(ABC):
+    """
+    The worksheet reads and writes the dashboard services use, `AsyncGCClient` runs them in its thread pool.
+    `GCClient` keeps the worksheets in the google spreadsheet, `LocalDashboardClient` in local files.
+    """
+
+    @abstractmethod
+    def open_spreadsheet(self, url: str = s.dashboard_url, refresh: bool = False):
+        """
+        The spreadsheet, its `worksheets()` carry the sheet titles
+        """
+
+    @abstractmethod
+    def get_modified_time(self, url: str = s.dashboard_url) -> str:
+        """
+        Changes whenever any worksheet of the spreadsheet is written
+        """
+
+    @abstractmethod
+    def get_ws(self, name: str, url: str = s.dashboard_url, to_type: str = "df"):
+        """
+        The worksheet titled `name` as a worksheet (`ws`) or as a DataFrame (`df`)
+        """
+
+    @abstractmethod
+    def get_as_df(self, ws, **kwargs) -> pd.DataFrame:
+        """
+        The worksheet as a DataFrame with the first row as header, numbers are converted like pygsheets does
+        """
+
+    @abstractmethod
+    def clear(self, ws, **kwargs):
+        """
+        Empty the worksheet
+        """
+
+    @abstractmethod
+    def set_dataframe(self, ws, df: pd.DataFrame, start: str = "A1", **kwargs):
+        """
+        Write the DataFrame with its header from `start`
+        """
+
+    @abstractmethod
+    def get_values(self, ws) -> Optional[Tuple[list, List[list]]]:
+        """
+        Header and rows of the worksheet as displayed strings, rows padded or cut to the header width,
+        None for an empty or missing worksheet
+        """
+
+    @abstractmethod
+    def sync_rows(self, tables: List[Tuple[object, List[str], List[list], List[str]]]) -> List[dict]:
+        """
+        Write each `(worksheet, header, rows, keys)` table, returns the inserted / updated / deleted rows of each
+        """
+
+    def sync_dataframe(self, ws, df: pd.DataFrame, keys: List[str]) -> dict:
+        return self.sync_dataframes([(ws, df, keys)])[0]
+
+    def sync_dataframes(self, tables: List[Tuple[object, pd.DataFrame, List[str]]]) -> List[dict]:
+        return self.sync_rows([(ws, *dataframe_rows(df), keys) for ws, df, keys in tables])
+
+
+class GCClient(DashboardBackend):
     def __init__(self):
-        self.gc_client = pg.authorize(service_file=s.gc_config_path)
+        self._gc_client = None
+        self._lock = threading.Lock()
+
+        # spreadsheet url -> (spreadsheet, worksheet title -> worksheet, fetch time)
+        self.spreadsheets = {}
+
+    @property
+    def gc_client(self) -> pg.client.Client:
+        # authorized on first use, so importing the services does not read the key file or call google
+        if self._gc_client is None:
+            with self._lock:
+                if self._gc_client is None:
+                    import pygsheets as pg
+
+                    with observe("authorize"):
+                        self._gc_client = pg.authorize(service_file=s.gc_config_path)
+        return self._gc_client
+
+    def open_spreadsheet(self, url: str = s.dashboard_url, refresh: bool = False) -> pg.Spreadsheet:
+        """
+        Spreadsheet handle, fetched again after `sheets_handle_ttl` seconds or when `refresh` is set
+        """
+        return self.get_handles(url, refresh)[0]
+
+    def get_handles(self, url: str, refresh: bool = False) -> Tuple[pg.Spreadsheet, dict, bool]:
+        # (spreadsheet, worksheet title -> worksheet, whether it was just fetched)
+        cached = self.spreadsheets.get(url)
+        if cached and not refresh and time.monotonic() - cached[2] < s.sheets_handle_ttl:
+            return cached[0], cached[1], False
+
+        with observe("open_by_url"):
+            spreadsheet = self.gc_client.open_by_url(url)
+        worksheets = {ws.title: ws for ws in spreadsheet.worksheets()}
+        self.spreadsheets[url] = (spreadsheet, worksheets, time.monotonic())
+        return spreadsheet, worksheets, True
+
+    def get_modified_time(self, url: str = s.dashboard_url) -> str:
+        """
+        Last modification time of the spreadsheet from drive, one small request that changes with any edit
+        """
+        spreadsheet = self.open_spreadsheet(url)
+        with observe("get_update_time"):
+            return self.gc_client.drive.get_update_time(spreadsheet.id)
+
+    def forget_spreadsheet(self, spreadsheet_id: str):
+        for url, cached in list(self.spreadsheets.items()):
+            if cached[0].id == spreadsheet_id:
+                self.spreadsheets.pop(url, None)
+
+    def get_worksheet(self, name: str, url: str = s.dashboard_url) -> Optional[pg.Worksheet]:
+        """
+        Worksheet by title from the cached handles, refetched once when the title is not found as it may be new
+        """
+        _, worksheets, fetched = self.get_handles(url)
+        if name not in worksheets and not fetched:
+            _, worksheets, _ = self.get_handles(url, refresh=True)
+        return worksheets.get(name)
 
     def get_ws(self, name: str, url: str = s.dashboard_url, to_type: str = "df") -> Union[pg.Worksheet, pd.DataFrame]:
-        ws = self.gc_client.open_by_url(url)
-        sheet_names = [i.title for i in ws.worksheets()]
+        ws = self.get_worksheet(name, url)
 
         if to_type == "df":
-            if name not in sheet_names:
+            if ws is None:
+                import pandas as pd
+
                 return pd.DataFrame()
             else:
-                return ws.worksheet_by_title(name).get_as_df()
+                return self.get_as_df(ws)
         elif to_type == "ws":
-            if name not in sheet_names:
-                return None
-            return ws.worksheet_by_title(name)
+            return ws
         else:
             raise ValueError(f"Invalid type `{to_type}` provided. Valid types are `df` and `ws`.")
+
+    # worksheet operations go through the client so every sheets call is timed
+    def get_as_df(self, ws: pg.Worksheet, **kwargs) -> pd.DataFrame:
+        with observe("get_as_df"):
+            return ws.get_as_df(**kwargs)
+
+    def clear(self, ws: pg.Worksheet, **kwargs):
+        with observe("clear"):
+            return ws.clear(**kwargs)
+
+    def set_dataframe(self, ws: pg.Worksheet, df: pd.DataFrame, start: str = "A1", **kwargs):
+        with observe("set_dataframe"):
+            return ws.set_dataframe(df, start=start, **kwargs)
+
+    def get_values(self, ws: pg.Worksheet) -> Optional[Tuple[list, List[list]]]:
+        with observe("get_all_values"):
+            values = ws.get_all_values(include_tailing_empty=False, include_tailing_empty_rows=False)
+        return self.to_table(values)
+
+    def get_values_batch(self, sheets: List[pg.Worksheet]) -> List[Optional[Tuple[list, List[list]]]]:
+        """
+        `get_values` of worksheets of one spreadsheet, read in one values `batchGet`
+        """
+        # a sheet title is quoted in A1 notation, a quote in it is doubled
+        ranges = ["'{}'".format(sheet.title.replace("'", "''")) for sheet in sheets]
+        with observe("values_batch_get"):
+            value_ranges = sheets[0].client.sheet.values_batch_get(sheets[0].spreadsheet.id, ranges)
+        return [self.to_table(value_range.get("values")) for value_range in value_ranges]
+
+    @staticmethod
+    def to_table(values: Optional[List[list]]) -> Optional[Tuple[list, List[list]]]:
+        if not values:
+            return None
+        header = values[0]
+        return header, [(row + [""] * len(header))[: len(header)] for row in values[1:]]
+
+    def sync_rows(self, tables: List[Tuple[pg.Worksheet, List[str], List[list], List[str]]]) -> List[dict]:
+        """
+        Write each table (header and rows of strings) to its worksheet, only sending what differs from its content.
+        Rows are matched by the `keys` columns: removed rows are deleted, new rows inserted at their position and
+        changed rows overwritten. When the header or the order of the kept rows changed, the sheet is overwritten
+        in place without clearing. The worksheets belong to one spreadsheet, all of them are read in one values
+        `batchGet` right before planning, so row numbers come from their current state and manual edits or writes
+        from another worker are not shifted or deleted. The row inserts / deletes of all of them are then sent in one
+        `batchUpdate` and the values in one values `batchUpdateByDataFilter`.
+        Values are written `RAW`, a cell reads back as the exact text written and unchanged rows compare equal.
+        Dates and numbers are therefore stored as text, not parsed into typed cells by Sheets.
+        """
+        if not tables:
+            return []
+        ws = tables[0][0]
+        if any(table[0].spreadsheet.id != ws.spreadsheet.id for table in tables):
+            raise ValueError("Worksheets synced together must belong to the same spreadsheet")
+
+        try:
+            requests, ranges, results = [], [], []
+            currents = self.get_values_batch([table[0] for table in tables])
+            for (sheet, header, rows, keys), current in zip(tables, currents):
+                plan = None
+                if current and current[0] == header:
+                    plan = diff_rows(current[1], rows, [header.index(k) for k in keys])
+
+                if plan is None:
+                    sheet_requests, sheet_ranges, grid, stats = self.plan_rewrite(sheet, header, rows, current)
+                else:
+                    sheet_requests, sheet_ranges, grid, stats = self.plan_diff(sheet, header, rows, plan)
+                requests += sheet_requests
+                ranges += sheet_ranges
+                results.append((sheet, header, rows, grid, stats))
+
+            self.batch_update(ws, requests)
+            self.batch_update_values(ws, ranges)
+        except Exception:
+            # the sheets may have been resized, renamed or deleted by hand, their handles are fetched again
+            self.forget_spreadsheet(ws.spreadsheet.id)
+            raise
+
+        for sheet, header, rows, grid, _ in results:
+            sheet.jsonSheet["properties"]["gridProperties"].update(grid)
+        return [result[-1] for result in results]
+
+    @staticmethod
+    def grid_range(ws: pg.Worksheet, start_row: int, end_row: int, start_col: int, end_col: int) -> dict:
+        return {
+            "sheetId": ws.id,
+            "startRowIndex": start_row,
+            "endRowIndex": end_row,
+            "startColumnIndex": start_col,
+            "endColumnIndex": end_col,
+        }
+
+    def batch_update(self, ws: pg.Worksheet, requests: List[dict]):
+        if requests:
+            with observe("batch_update"):
+                ws.client.sheet.batch_update(ws.spreadsheet.id, requests)
+
+    def batch_update_values(self, ws: pg.Worksheet, ranges: List[Tuple[dict, List[list]]]):
+        if ranges:
+            data = [{"dataFilter": {"gridRange": r}, "majorDimension": "ROWS", "values": v} for r, v in ranges]
+            with observe("values_batch_update"):
+                ws.client.sheet.values_batch_update_by_data_filter(ws.spreadsheet.id, data, parse=False)
+
+    def plan_diff(self, ws: pg.Worksheet, header: list, rows: List[list], plan: dict) -> tuple:
+        """
+        `(requests, value ranges, grid size after the requests, stats)` writing the `diff_rows` plan
+        """
+        # sheet row = data row + 1 for the header, deletes run bottom up on the old rows,
+        # then inserts run top down on the final positions
+        requests = []
+        for start, end in reversed(to_runs(plan["deleted"])):
+            requests.append(
+                {
+                    "deleteDimension": {
+                        "range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": start + 1, "endIndex": end + 1}
+                    }
+                }
+            )
+        for start, end in to_runs(plan["inserted"]):
+            requests.append(
+                {
+                    "insertDimension": {
+                        "range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": start + 1, "endIndex": end + 1},
+                        # rows right under the header take the format of the data row below them
+                        "inheritFromBefore": start > 0,
+                    }
+                }
+            )
+
+        written = sorted(plan["inserted"] + plan["changed"])
+        ranges = [
+            (self.grid_range(ws, start + 1, end + 1, 0, len(header)), rows[start:end])
+            for start, end in to_runs(written)
+        ]
+        stats = {
+            "inserted": len(plan["inserted"]),
+            "updated": len(plan["changed"]),
+            "deleted": len(plan["deleted"]),
+            "rewritten": False,
+        }
+        return requests, ranges, {"rowCount": ws.rows + len(plan["inserted"]) - len(plan["deleted"])}, stats
+
+    def plan_rewrite(self, ws: pg.Worksheet, header: list, rows: List[list], current: Optional[tuple]) -> tuple:
+        """
+        `(requests, value ranges, grid size after the requests, stats)` overwriting the whole table
+        """
+        values = [header] + rows
+        height, width = len(values), len(header)
+        old_height = len(current[1]) + 1 if current else 0
+        old_width = len(current[0]) if current else 0
+
+        requests = []
+        if height > ws.rows:
+            requests.append({"appendDimension": {"sheetId": ws.id, "dimension": "ROWS", "length": height - ws.rows}})
+        if width > ws.cols:
+            requests.append({"appendDimension": {"sheetId": ws.id, "dimension": "COLUMNS", "length": width - ws.cols}})
+
+        # cells of the previous content outside the new table are emptied in the same call
+        ranges = [(self.grid_range(ws, 0, height, 0, width), values)]
+        if old_height > height:
+            blank_width = max(width, old_width)
+            ranges.append(
+                (self.grid_range(ws, height, old_height, 0, blank_width), [[""] * blank_width] * (old_height - height))
+            )
+        if old_width > width:
+            ranges.append((self.grid_range(ws, 0, height, width, old_width), [[""] * (old_width - width)] * height))
+
+        grid = {"rowCount": max(ws.rows, height), "columnCount": max(ws.cols, width)}
+        stats = {"inserted": 0, "updated": len(rows), "deleted": max(old_height - height, 0), "rewritten": True}
+        return requests, ranges, grid, stats
+
+
+def create_dashboard_client() -> DashboardBackend:
+    """
+    `GCClient`, or its file backed stand-in when `dashboard_backend` is `local`
+    """
+    if s.dashboard_backend == "local":
+        from app.db.local_dashboard import LocalDashboardClient
+
+        return LocalDashboardClient()
+    if s.dashboard_backend != "sheets":
+        raise ValueError(f"Invalid dashboard backend `{s.dashboard_backend}`, valid backends are `sheets` and `local`")
+    return GCClient()
+
+
+class AsyncGCClient:
+    """
+    Awaitable `DashboardBackend` for the services. pygsheets calls block, so they run in a thread pool of
+    `sheets_max_workers` threads shared by every client and the event loop keeps serving other requests.
+    A read stops being awaited after `sheets_timeout` seconds or when the task is cancelled, a read that is already
+    running still finishes in its thread, a queued one is dropped. Writes are not timed out: a cancelled task
+    drops a queued write but waits for a running one, so the caller's per-sheet lock is only released once no
+    thread writes to the sheet anymore.
+    """
+
+    executor = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self, client: DashboardBackend = None):
+        self.client = client or create_dashboard_client()
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        if cls.executor is None:
+            with cls._executor_lock:
+                if cls.executor is None:
+                    cls.executor = ThreadPoolExecutor(max_workers=s.sheets_max_workers, thread_name_prefix="sheets")
+        return cls.executor
+
+    @classmethod
+    def shutdown(cls):
+        if cls.executor is not None:
+            cls.executor.shutdown(wait=False, cancel_futures=True)
+            cls.executor = None
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        # the copied context keeps the request span as the parent of the sheets spans recorded in the thread
+        context = contextvars.copy_context()
+        return self.get_executor().submit(functools.partial(context.run, func, *args, **kwargs))
+
+    async def run(self, func, *args, **kwargs):
+        future = asyncio.wrap_future(self.submit(func, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout=s.sheets_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Google Sheets call `{func.__name__}` timed out after {s.sheets_timeout}s")
+
+    async def run_write(self, func, *args, **kwargs):
+        concurrent_future = self.submit(func, *args, **kwargs)
+        future = asyncio.wrap_future(concurrent_future)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # a write that already started cannot be stopped, it is waited for before the cancellation goes on
+            if not concurrent_future.cancel():
+                await asyncio.wait([future])
+            raise
+
+    async def open_spreadsheet(self, url: str = s.dashboard_url) -> pg.Spreadsheet:
+        return await self.run(self.client.open_spreadsheet, url)
+
+    async def get_modified_time(self, url: str = s.dashboard_url) -> str:
+        return await self.run(self.client.get_modified_time, url)
+
+    async def get_ws(
+        self, name: str, url: str = s.dashboard_url, to_type: str = "df"
+    ) -> Union[pg.Worksheet, pd.DataFrame]:
+        return await self.run(self.client.get_ws, name, url, to_type)
+
+    async def get_as_df(self, ws: pg.Worksheet, **kwargs) -> pd.DataFrame:
+        return await self.run(self.client.get_as_df, ws, **kwargs)
+
+    async def get_values(self, ws: pg.Worksheet) -> Optional[Tuple[list, List[list]]]:
+        return await self.run(self.client.get_values, ws)
+
+    async def sync_dataframe(self, ws: pg.Worksheet, df: pd.DataFrame, keys: List[str]) -> dict:
+        return await self.run_write(self.client.sync_dataframe, ws, df, keys)
+
+    async def sync_dataframes(self, tables: List[Tuple[pg.Worksheet, pd.DataFrame, List[str]]]) -> List[dict]:
+        return await self.run_write(self.client.sync_dataframes, tables)
+
+    async def sync_rows(self, tables: List[Tuple[pg.Worksheet, List[str], List[list], List[str]]]) -> List[dict]:
+        return await self.run_write(self.client.sync_rows, tables)
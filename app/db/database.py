@@ -1,33 +1,65 @@
-from typing import Any, Dict, List
+import uuid
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, List, Tuple
 
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
 from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
 from app.config.setting import settings
+from app.metrics.registry import MONGO_OPERATION_LATENCY
+from app.tracing import span
+
+
+@contextmanager
+def observe(operation: str, collection: str):
+    # every mongo call is timed and recorded as a span of the current request
+    with span(f"mongo.{operation}", collection=collection):
+        with MONGO_OPERATION_LATENCY.time(operation=operation, collection=collection):
+            yield
 
 
 class MongoClient:
+    versions_collection = "versions"
+
     def __init__(self, db: str):
-        self.client = AsyncIOMotorClient(settings.mongo_db_url)
-        self.db = self.client[db]
+        self.db_name = db
+        self._client = None
+        self._versions_indexed = False
+
+    @property
+    def client(self) -> AsyncIOMotorClient:
+        # created on first use, so importing the services does not start the driver's monitor threads
+        if self._client is None:
+            self._client = AsyncIOMotorClient(settings.mongo_db_url)
+        return self._client
+
+    @property
+    def db(self) -> Database:
+        return self.client[self.db_name]
 
     def get_collection(self, name: str) -> Collection:
         return self.db[name]
 
     async def insert_one(self, name: str, document: dict) -> str:
         collection = self.get_collection(name)
-        result = await collection.insert_one(document)
+        with observe(operation="insert_one", collection=name):
+            result = await collection.insert_one(document)
         if str(result.inserted_id):
             return await self.find_one(name, {"_id": result.inserted_id})
 
     async def insert_many(self, name: str, documents: List[dict]) -> List[str]:
         collection = self.get_collection(name)
-        result = await collection.insert_many(documents)
+        with observe(operation="insert_many", collection=name):
+            result = await collection.insert_many(documents)
         return await self.find_many(name, {"_id": {"$in": result.inserted_ids}})
 
     async def find_one(self, name: str, query: Dict[str, Any]) -> Dict[str, Any]:
         collection: Collection = self.get_collection(name)
-        result = await collection.find_one(query)
+        with observe(operation="find_one", collection=name):
+            result = await collection.find_one(query)
         if result:
             result.pop("_id", None)
         return result
@@ -45,26 +77,130 @@ class MongoClient:
             cursor = cursor.limit(limit)
 
         result = []
-        async for document in cursor:
-            document.pop("_id", None)
-            result.append(document)
+        with observe(operation="find_many", collection=name):
+            async for document in cursor:
+                document.pop("_id", None)
+                result.append(document)
         return result
 
-    async def update_one(self, name: str, query: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    async def iter_batches(
+        self, name: str, query: Dict[str, Any], sort: List[tuple] = None, batch_size: int = 1000
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream the matching documents in lists of up to `batch_size`, only one batch is held in memory
+        """
+        collection: Collection = self.get_collection(name)
+        cursor = collection.find(query, batch_size=batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        while True:
+            with observe(operation="iter_batches", collection=name):
+                batch = await cursor.to_list(length=batch_size)
+            if not batch:
+                return
+            for document in batch:
+                document.pop("_id", None)
+            yield batch
+
+    async def create_index(self, name: str, keys: List[tuple], unique: bool = False) -> str:
+        """
+        Create the index on `keys` unless it already exists, returns its name
+        """
+        collection: Collection = self.get_collection(name)
+        with observe(operation="create_index", collection=name):
+            return await collection.create_index(keys, unique=unique)
+
+    async def aggregate(self, name: str, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        collection: Collection = self.get_collection(name)
+        with observe(operation="aggregate", collection=name):
+            return [document async for document in collection.aggregate(pipeline)]
+
+    async def update_one(
+        self, name: str, query: Dict[str, Any], update: Dict[str, Any], unset: List[str] = None
+    ) -> Dict[str, Any]:
         collection: Collection = self.get_collection(name)
-        result = await collection.find_one_and_update(query, {"$set": update}, return_document=True)
+        operations = {"$set": update}
+        if unset:
+            operations["$unset"] = {field: "" for field in unset}
+        with observe(operation="update_one", collection=name):
+            result = await collection.find_one_and_update(query, operations, return_document=True)
         result.pop("_id", None)
         return result
 
+    async def bulk_update(self, name: str, updates: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> int:
+        """
+        `$set` each `(query, update)` pair in one round trip, returns the number of modified documents
+        """
+        if not updates:
+            return 0
+        collection: Collection = self.get_collection(name)
+        with observe(operation="bulk_update", collection=name):
+            result = await collection.bulk_write([UpdateOne(q, {"$set": u}) for q, u in updates], ordered=False)
+        return result.modified_count
+
     async def delete_one(self, name: str, query: Dict[str, Any]) -> bool:
         collection: Collection = self.get_collection(name)
-        result = await collection.delete_one(query)
+        with observe(operation="delete_one", collection=name):
+            result = await collection.delete_one(query)
         return result.deleted_count > 0
 
     async def delete_many(self, name: str, query: Dict[str, Any]) -> bool:
         collection: Collection = self.get_collection(name)
-        result = await collection.delete_many(query)
+        with observe(operation="delete_many", collection=name):
+            result = await collection.delete_many(query)
         return result.deleted_count > 0
 
+    async def get_version(self, name: str) -> str:
+        """
+        Version of a collection, changed by `bump_version` whenever the services write to it.
+        The epoch is regenerated if the version record is lost, so old versions are never reused.
+        """
+        result = await self.find_one(self.versions_collection, {"collection": name})
+        if not result:
+            return await self.bump_version(name)
+        return f"{result['epoch']}-{result['version']}"
+
+    async def index_versions(self):
+        """
+        One version record per collection, two concurrent first upserts would otherwise insert two of them
+        """
+        try:
+            await self.create_index(self.versions_collection, [("collection", 1)], unique=True)
+        except OperationFailure as e:
+            if e.code != 11000:
+                raise
+            # duplicates left from before the index, the records are dropped and start again with a new epoch
+            await self.delete_many(self.versions_collection, {})
+            await self.create_index(self.versions_collection, [("collection", 1)], unique=True)
+        self._versions_indexed = True
+
+    async def bump_version(self, name: str) -> str:
+        if not self._versions_indexed:
+            await self.index_versions()
+        collection: Collection = self.get_collection(self.versions_collection)
+
+        async def bump():
+            with observe(operation="bump_version", collection=name):
+                return await collection.find_one_and_update(
+                    {"collection": name},
+                    {"$inc": {"version": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+
+        try:
+            result = await bump()
+        except DuplicateKeyError:
+            # a concurrent first bump inserted the record meanwhile, the retry matches and increments it
+            result = await bump()
+        return f"{result['epoch']}-{result['version']}"
+
+    async def ping(self):
+        with observe(operation="ping", collection=""):
+            await self.client.admin.command("ping")
+
     async def close(self):
-        self.client.close()
+        if self._client is not None:
+            self._client.close()
+            self._client = None
@@ -0,0 +1,55 @@
+from operator import itemgetter
+from typing import Callable, List, Optional
+
+# a formatter turns all the values of one column into their cell strings at once
+Formatter = Callable[[list], List[str]]
+
+
+def format_text(values: list) -> List[str]:
+    return ["" if v is None else str(v) for v in values]
+
+
+def format_timestamp_ms(values: list) -> List[str]:
+    # converted as one array, every cell of the column gets the same precision
+    import pandas as pd
+
+    times = pd.to_datetime(pd.Series(values, dtype="float64"), unit="ms")
+    return [("" if missing else text) for text, missing in zip(times.astype(str).tolist(), times.isna().tolist())]
+
+
+def format_chat_names(values: list) -> List[str]:
+    chat_name = itemgetter("chat_name")
+    return ["" if chats is None else ", ".join(map(chat_name, chats)) for chats in values]
+
+
+class ExportColumn:
+    def __init__(self, field: str, title: str, formatter: Formatter = format_text):
+        self.field = field
+        self.title = title
+        self.formatter = formatter
+
+
+class ExportSpec:
+    """
+    Declares how a collection is exported to a dashboard sheet: the sheet name, the columns in order with the
+    document field and formatter of each, and the `keys` columns identifying a row for the diff sync.
+    Rows are built column by column from the raw documents, without a DataFrame.
+    """
+
+    def __init__(self, name: str, sheet: str, columns: List[ExportColumn], keys: Optional[List[str]] = None):
+        self.name = name
+        self.sheet = sheet
+        self.columns = columns
+        self.keys = keys or [columns[0].title]
+
+    @property
+    def header(self) -> List[str]:
+        return [column.title for column in self.columns]
+
+    def to_rows(self, documents: List[dict]) -> List[List[str]]:
+        cells = [column.formatter([document.get(column.field) for document in documents]) for column in self.columns]
+        return [list(row) for row in zip(*cells)]
+
+    def to_records(self, rows: List[List[str]]) -> List[dict]:
+        header = self.header
+        return [dict(zip(header, row)) for row in rows]
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import csv
+import os
+import threading
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+from urllib.parse import quote, unquote
+
+from app.config.setting import settings as s
+from app.db.dashboard import DashboardBackend
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+FORMATS = ("csv", "parquet")
+
+
+class LocalWorksheet:
+    """
+    One worksheet stored as a file of strings, with the pygsheets methods the services and tests use
+    """
+
+    def __init__(self, spreadsheet: LocalSpreadsheet, title: str):
+        self.spreadsheet = spreadsheet
+        self.title = title
+
+    @property
+    def path(self) -> str:
+        # sheet titles are percent-encoded into file names, so `worksheets()` gives back the exact titles
+        name = quote(self.title, safe=" ")
+        return os.path.join(self.spreadsheet.path, f"{name}.{self.spreadsheet.file_format}")
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def get_all_values(self, **kwargs) -> List[List[str]]:
+        if not self.exists:
+            return []
+        if self.spreadsheet.file_format == "csv":
+            with open(self.path, newline="", encoding="utf-8") as f:
+                return list(csv.reader(f))
+
+        import pandas as pd
+
+        df = pd.read_parquet(self.path)
+        return [list(df.columns)] + df.values.tolist()
+
+    def update_values(self, values: List[List[str]]):
+        os.makedirs(self.spreadsheet.path, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"  # replaced in one step, a reader never sees half a file
+        if self.spreadsheet.file_format == "csv":
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(values)
+        else:
+            import pandas as pd
+
+            header = values[0] if values else []
+            pd.DataFrame(values[1:], columns=header, dtype=str).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+
+    def get_as_df(self, numerize: bool = True, empty_value: str = "", **kwargs) -> pd.DataFrame:
+        import pandas as pd
+        from pygsheets.utils import numericise_all
+
+        values = self.get_all_values()
+        if not values:
+            return pd.DataFrame()
+        # numbers become int / float and empty cells `empty_value`, the same frame pygsheets reads from a sheet
+        width = max(len(row) for row in values)
+        values = [row + [""] * (width - len(row)) for row in values]
+        if numerize:
+            values = [numericise_all(row, empty_value) for row in values]
+        return pd.DataFrame(values[1:], columns=values[0])
+
+    def clear(self, **kwargs):
+        if self.exists:
+            os.remove(self.path)
+
+    def set_dataframe(self, df: pd.DataFrame, start: Union[str, tuple] = "A1", copy_head: bool = True, **kwargs):
+        if start not in ("A1", (1, 1)):
+            raise ValueError(f"Local worksheets are only written from A1, got `{start}`")
+        rows = df.astype(str).values.tolist()
+        self.update_values(([[str(c) for c in df.columns]] if copy_head else []) + rows)
+
+
+class LocalSpreadsheet:
+    def __init__(self, path: str, file_format: str):
+        if file_format not in FORMATS:
+            raise ValueError(f"Invalid local dashboard format `{file_format}`, valid formats are {FORMATS}")
+        self.path = path
+        self.file_format = file_format
+        self.id = os.path.abspath(path)
+
+    def worksheets(self) -> List[LocalWorksheet]:
+        if not os.path.isdir(self.path):
+            return []
+        suffix = f".{self.file_format}"
+        return [
+            LocalWorksheet(self, unquote(name[: -len(suffix)]))
+            for name in sorted(os.listdir(self.path))
+            if name.endswith(suffix)
+        ]
+
+
+class LocalDashboardClient(DashboardBackend):
+    """
+    Stand-in for `GCClient` keeping every worksheet as a csv or parquet file in `dashboard_local_dir`,
+    for tests, benchmarks and local development without a service account or a live spreadsheet.
+    A worksheet is created by its first write, reading a missing one gives no rows like an empty sheet.
+    """
+
+    def __init__(self, path: str = None, file_format: str = None):
+        self.spreadsheet = LocalSpreadsheet(path or s.dashboard_local_dir, file_format or s.dashboard_local_format)
+        self._lock = threading.Lock()
+
+    def open_spreadsheet(self, url: str = None, refresh: bool = False) -> LocalSpreadsheet:
+        return self.spreadsheet
+
+    def get_modified_time(self, url: str = None) -> str:
+        # changes with any write, like the drive `modifiedTime` of the spreadsheet
+        paths = [ws.path for ws in self.spreadsheet.worksheets()]
+        return str(max((os.stat(path).st_mtime_ns for path in paths), default=0))
+
+    def get_ws(self, name: str, url: str = None, to_type: str = "df") -> Union[LocalWorksheet, pd.DataFrame]:
+        ws = LocalWorksheet(self.spreadsheet, name)
+        if to_type == "df":
+            return self.get_as_df(ws)
+        elif to_type == "ws":
+            return ws
+        else:
+            raise ValueError(f"Invalid type `{to_type}` provided. Valid types are `df` and `ws`.")
+
+    def get_as_df(self, ws: LocalWorksheet, **kwargs) -> pd.DataFrame:
+        return ws.get_as_df(**kwargs)
+
+    def clear(self, ws: LocalWorksheet, **kwargs):
+        return ws.clear(**kwargs)
+
+    def set_dataframe(self, ws: LocalWorksheet, df: pd.DataFrame, start: str = "A1", **kwargs):
+        return ws.set_dataframe(df, start=start, **kwargs)
+
+    def get_values(self, ws: LocalWorksheet) -> Optional[Tuple[list, List[list]]]:
+        values = ws.get_all_values()
+        if not values:
+            return None
+        header = values[0]
+        return header, [(row + [""] * len(header))[: len(header)] for row in values[1:]]
+
+    def sync_rows(self, tables: List[Tuple[LocalWorksheet, List[str], List[list], List[str]]]) -> List[dict]:
+        stats = []
+        with self._lock:
+            for ws, header, rows, _ in tables:
+                old = self.get_values(ws)
+                ws.update_values([header] + rows)
+                deleted = max(len(old[1]) - len(rows), 0) if old else 0
+                stats.append({"inserted": 0, "updated": len(rows), "deleted": deleted, "rewritten": True})
+        return stats
@@ -0,0 +1,57 @@
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+import orjson
+from pydantic import BaseModel
+
+from app.metrics.registry import SINGLE_FLIGHT_SHARED
+
+
+def params_key(params: BaseModel) -> str:
+    """
+    Normalized key of query params, list values are sorted since they are only used in `$in` filters
+    """
+    data = {k: sorted(v) if isinstance(v, list) else v for k, v in params.model_dump(mode="json").items()}
+    return orjson.dumps(data, option=orjson.OPT_SORT_KEYS).decode()
+
+
+class Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.callers = 0
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one in-flight call and its result.
+    Nothing is cached, the key is released as soon as the call finishes.
+    A call started before the last `invalidate` is never joined, so a read issued after a write sees it.
+    The result of a shared call is copied for each caller, one caller changing it does not affect the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.generation = 0
+        self.calls: Dict[Tuple[int, str], Flight] = {}
+
+    def invalidate(self):
+        """
+        Called after every write, the calls in flight may have read the data before it
+        """
+        self.generation += 1
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        flight_key = (self.generation, key)
+        flight = self.calls.get(flight_key)
+        if flight is None:
+            # a separate task, so a cancelled caller does not cancel the call the others are waiting on
+            flight = Flight(asyncio.ensure_future(func()))
+            self.calls[flight_key] = flight
+            flight.task.add_done_callback(lambda _: self.calls.pop(flight_key, None))
+        else:
+            SINGLE_FLIGHT_SHARED.inc(name=self.name)
+        flight.callers += 1
+        result = await asyncio.shield(flight.task)
+        # the key is released before the callers resume, no caller can join once the first one has the result
+        return copy.deepcopy(result) if flight.callers > 1 else result
@@ -0,0 +1,127 @@
+import contextlib
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+from typing import List
+
+from app.config.setting import settings as s
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # pyinstrument is optional, the deterministic cProfile is used without it
+    Profiler = None
+
+PROFILE_DIR = f"{os.path.dirname(os.path.dirname(os.path.realpath(__file__)))}/profiles"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}-[0-9a-f]{16}$")
+FORMATS = {"speedscope": ".speedscope.json", "pstats": ".pstats"}
+
+# only one profiler can hook the interpreter at a time, a request arriving meanwhile is not profiled
+active_lock = threading.Lock()
+# saves run in threads after `active_lock` is released, old profiles are removed by one of them at a time
+cleanup_lock = threading.Lock()
+
+
+def should_profile(request) -> bool:
+    token = request.headers.get("X-Profile")
+    if token and s.profiling_token:
+        return hmac.compare_digest(token, s.profiling_token)
+    return random.random() < s.profiling_sample_rate
+
+
+class RequestProfiler:
+    """
+    Sampling profile of one request saved in the speedscope format, or a pstats file when pyinstrument is missing.
+    Every coroutine running on the loop meanwhile shows up as well, so concurrent requests can appear in it.
+    """
+
+    def __init__(self):
+        if Profiler is not None:
+            self.profiler = Profiler(interval=s.profiling_interval, async_mode="enabled")
+            self.format = "speedscope"
+        else:
+            self.profiler = cProfile.Profile()
+            self.format = "pstats"
+
+    def start(self):
+        if self.format == "speedscope":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.format == "speedscope":
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+
+    def save(self, profile_id: str) -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = f"{PROFILE_DIR}/{profile_id}{FORMATS[self.format]}"
+        # written under a `.tmp` name then renamed, `/debug/profiles` never lists or serves a partial file
+        tmp_path = f"{path}.tmp"
+        if self.format == "speedscope":
+            with open(tmp_path, "w") as f:
+                f.write(self.profiler.output(renderer=SpeedscopeRenderer()))
+        else:
+            self.profiler.dump_stats(tmp_path)
+        os.replace(tmp_path, path)
+        remove_old_profiles()
+        return path
+
+
+def split_profile_name(name: str) -> tuple:
+    for profile_format, suffix in FORMATS.items():
+        if name.endswith(suffix):
+            return name[: -len(suffix)], profile_format
+    return None, None
+
+
+def list_profiles() -> List[dict]:
+    """
+    Saved profiles, newest first. `profile_id` is the request id (`X-Request-ID`) and the request span id
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+
+    profiles = []
+    for entry in os.scandir(PROFILE_DIR):
+        profile_id, profile_format = split_profile_name(entry.name)
+        if profile_id is None:
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:  # removed by another save meanwhile
+            continue
+        profiles.append(
+            {
+                "profile_id": profile_id,
+                "request_id": profile_id.split("-")[0],
+                "format": profile_format,
+                "size": stat.st_size,
+                "created_timestamp": int(stat.st_mtime * 1000),
+            }
+        )
+    return sorted(profiles, key=lambda x: x["created_timestamp"], reverse=True)
+
+
+def get_profile_path(profile_id: str) -> str:
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    for suffix in FORMATS.values():
+        path = f"{PROFILE_DIR}/{profile_id}{suffix}"
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def remove_old_profiles():
+    with cleanup_lock:
+        for profile in list_profiles()[s.profiling_max_files :]:
+            path = get_profile_path(profile["profile_id"])
+            if path is not None:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
@@ -0,0 +1,27 @@
+import os
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+
+from app.auth.services import verify_api_key
+from app.debug.profiler import get_profile_path, list_profiles
+from app.responses import FastJSONResponse
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.get("/profiles")
+async def list_profiles_route():
+    try:
+        res = list_profiles()
+        return FastJSONResponse({"status": 1, "data": res})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing profiles: {e}")
+
+
+@router.get("/profiles/{profile_id}")
+async def get_profile_route(profile_id: str):
+    path = get_profile_path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail=f"Profile not found with id: `{profile_id}`")
+    return FileResponse(path, filename=os.path.basename(path))
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, HTTPException
+
+from app.health.warmup import readiness
+from app.responses import FastJSONResponse
+
+router = APIRouter()
+
+
+# no api key, it is polled by the platform health checks
+@router.get("")
+async def get_readiness_route():
+    try:
+        res = readiness.to_dict()
+        return FastJSONResponse(
+            {"status": 1 if res["ready"] else 0, "data": res}, status_code=200 if res["ready"] else 503
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting readiness: {e}")
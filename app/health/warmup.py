@@ -0,0 +1,98 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from app.auth import services as auth_services
+from app.chat_info import services as chat_info_services
+from app.config.setting import settings as s
+from app.tickets import services as tickets_services
+from app.users import services as users_services
+
+# every services module owns its mongo and sheets client, each of them is warmed up
+MONGO_SERVICES = (auth_services, users_services, chat_info_services, tickets_services)
+SHEETS_SERVICES = (users_services, chat_info_services, tickets_services)
+
+
+class Readiness:
+    """
+    Warm-up result of each dependency, the app is ready once every warm-up has succeeded
+    """
+
+    def __init__(self):
+        self.dependencies = {}
+        self.finished = False
+
+    @property
+    def ready(self) -> bool:
+        return self.finished and all(dep["status"] == "ok" for dep in self.dependencies.values())
+
+    def reset(self):
+        self.dependencies = {}
+        self.finished = False
+
+    def to_dict(self) -> dict:
+        return {"ready": self.ready, "dependencies": self.dependencies}
+
+
+readiness = Readiness()
+
+
+async def warm_mongo():
+    await asyncio.gather(*[service.client.ping() for service in MONGO_SERVICES])
+
+
+async def warm_auth_cache():
+    await auth_services.prime_api_key_cache()
+
+
+async def warm_sheets():
+    # authorize and open the dashboard once per client
+    await asyncio.gather(*[service.gc_client.open_spreadsheet() for service in SHEETS_SERVICES])
+
+
+async def warm_telegram():
+    from app.tickets.bot import EventBot, call_bot
+
+    await call_bot(EventBot(token=s.event_bot_token).get_me)
+
+
+WARM_UPS = {
+    "mongo": warm_mongo,
+    "auth_cache": warm_auth_cache,
+    "sheets": warm_sheets,
+    "telegram": warm_telegram,
+}
+
+
+async def run_warm_up(name: str, func):
+    """
+    Run the warm-up until it succeeds, a failure is retried with exponential backoff and reported meanwhile
+    """
+    readiness.dependencies[name] = {"status": "pending", "latency_ms": None, "attempts": 0}
+    delay = s.warm_up_retry_delay
+    for attempt in itertools.count(1):
+        start = time.perf_counter()
+        try:
+            await func()
+            readiness.dependencies[name] = {"status": "ok", "attempts": attempt}
+        except Exception as e:
+            logging.getLogger("main").exception(f"Warm-up of {name} failed, attempt {attempt}, retry in {delay}s")
+            readiness.dependencies[name] = {"status": "error", "error": str(e), "attempts": attempt}
+        readiness.dependencies[name]["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        if readiness.dependencies[name]["status"] == "ok":
+            return
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, s.warm_up_max_retry_delay)
+
+
+async def warm_up():
+    """
+    Open the connections the first requests would otherwise pay for: mongo server selection, api key lookups,
+    google auth with the dashboard spreadsheet and the telegram tls session. All of them run concurrently,
+    and this returns once every one of them has succeeded.
+    """
+    readiness.reset()
+    await asyncio.gather(*[run_warm_up(name, func) for name, func in WARM_UPS.items()])
+    readiness.finished = True
+    return readiness.to_dict()
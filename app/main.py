@@ -1,61 +1,276 @@
 # app/main.py
+import asyncio
+import atexit
+import copy
+import json
 import logging
+import math
 import os
+import queue
+import random
+import time
 from argparse import ArgumentParser
-from logging.handlers import TimedRotatingFileHandler
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 
 import uvicorn
 from fastapi import FastAPI
 
+from app.auth import rate_limit
 from app.auth.routes import router as auth_router
+from app.auth.services import get_api_key
 from app.chat_info.routes import router as chat_info_router
+from app.compression import CompressionMiddleware
 from app.config.setting import settings as s
+from app.dashboard.routes import router as dashboard_router
+from app.dashboard.sync import flush_all as flush_dashboard_syncs
+from app.db.dashboard import AsyncGCClient
+from app.debug.profiler import RequestProfiler, active_lock, should_profile
+from app.debug.routes import router as debug_router
+from app.health.routes import router as health_router
+from app.health.warmup import warm_up
+from app.metrics.loop_monitor import LoopLagMonitor
+from app.metrics.registry import HTTP_REQUEST_LATENCY
+from app.metrics.routes import router as metrics_router
+from app.responses import FastJSONResponse
 from app.tickets.routes import router as tickets_router
+from app.tracing import (
+    JsonFileExporter,
+    OTLPExporter,
+    current_span,
+    parse_trace_headers,
+    setup_tracing,
+    span,
+)
 from app.users.routes import router as users_router
 
 cp = os.path.dirname(os.path.realpath(__file__))
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    Format each record as one json line, fields passed with `extra={"fields": {...}}` are merged in
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "name": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        data.update(getattr(record, "fields", {}))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class JsonQueueHandler(QueueHandler):
+    """
+    `QueueHandler.prepare` folds the traceback into the message, keep it in `exc_text` for `JsonFormatter` instead
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = JsonFormatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
 def setup_logger(name: str):
+    """
+    Records are put on a queue by the request handlers and written to the file by a `QueueListener` thread,
+    so a slow disk never blocks the event loop.
+    """
     logger = logging.getLogger(name)
+    if logger.handlers:  # already set up by a previous `create_app`
+        return logger
     logger.setLevel(logging.INFO)
+    logger.propagate = False
 
     # create handler for each log a day
-    handler = TimedRotatingFileHandler(
+    os.makedirs(f"{cp}/logs", exist_ok=True)
+    file_handler = TimedRotatingFileHandler(
         f"{cp}/logs/main.log",
         when="midnight",
         interval=1,
     )
+    file_handler.setFormatter(JsonFormatter())
 
-    # create formatter
-    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
     # add handler to logger
-    logger.addHandler(handler)
+    logger.addHandler(JsonQueueHandler(log_queue))
     return logger
 
 
+def get_span_exporter():
+    if s.trace_exporter == "file":
+        return JsonFileExporter(f"{cp}/logs/traces.jsonl", s.trace_file_max_bytes, s.trace_file_backups)
+    elif s.trace_exporter == "otlp":
+        return OTLPExporter(s.otlp_endpoint)
+    return None
+
+
+async def read_body_for_log(request) -> str:
+    """
+    Body is logged as truncated raw text without parsing it.
+    Bodies longer than `log_body_max_length` are only read for a `log_large_body_sample_rate` share of requests
+    """
+    length = int(request.headers.get("content-length") or 0)
+    if length > s.log_body_max_length and random.random() >= s.log_large_body_sample_rate:
+        return f"<{length} bytes not sampled>"
+
+    body = (await request.body()).decode(errors="replace")
+    if len(body) > s.log_body_max_length:
+        return f"{body[:s.log_body_max_length]}...<{len(body)} chars>"
+    return body
+
+
 # create app
 def create_app(is_test: bool = False):
     s.is_test = is_test
-    app = FastAPI()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        monitor = LoopLagMonitor("api", s.loop_lag_interval, s.loop_block_threshold, logger)
+        monitor.start()
+        # requests are served while the connections warm up, `/ready` flips once all of them are done
+        task = asyncio.create_task(warm_up())
+        yield
+        task.cancel()
+        await flush_dashboard_syncs(s.dashboard_shutdown_timeout)
+        monitor.stop()
+        AsyncGCClient.shutdown()
+
     logger = setup_logger("main")
+    app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
+    setup_tracing(get_span_exporter())
+
+    # registered before `log_requests` so throttled requests are still logged
+    @app.middleware("http")
+    async def limit_requests(request, call_next):
+        key = await get_api_key(request.headers.get("X-API-KEY"), request.headers.get("X-API-SECRET"))
+        if not key:
+            # invalid key is rejected by `verify_api_key`
+            return await call_next(request)
+
+        limiter = rate_limit.limiter
+        retry_after = await limiter.acquire(key)
+        if retry_after:
+            return FastJSONResponse(
+                status_code=429,
+                content={"detail": f"Too many requests for key `{key.name}`"},
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+        try:
+            return await call_next(request)
+        finally:
+            await limiter.release(key)
 
     @app.middleware("http")
     async def log_requests(request, call_next):
-        auth_key = request.headers.get("X-API-KEY", "No API Key")
-        params = request.query_params if request.method == "GET" else await request.json()
-        client_ip = request.client.host if request.client else "Unknown IP"
-        logger.info(f"Request received: {request.method} - {request.url.path} - {params} - {auth_key} - {client_ip}")
-        response = await call_next(request)
-        logger.info(f"Response sent: {response.status_code}")
+        start = time.perf_counter()
+        fields = {
+            "method": request.method,
+            "path": request.url.path,
+            "params": str(request.query_params),
+            "api_key": request.headers.get("X-API-KEY", "No API Key"),
+            "client_ip": request.client.host if request.client else "Unknown IP",
+        }
+        if request.method != "GET":
+            fields["body"] = await read_body_for_log(request)
+
+        try:
+            response = await call_next(request)
+        except Exception:
+            fields["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            logger.exception("Request failed", extra={"fields": fields})
+            raise
+
+        fields["status_code"] = response.status_code
+        fields["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        logger.info("Request handled", extra={"fields": fields})
+        return response
+
+    # registered after `limit_requests` so throttled requests are also timed
+    @app.middleware("http")
+    async def record_metrics(request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # label by route template to keep the number of series bounded
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_LATENCY.observe(time.perf_counter() - start, method=request.method, route=route, status=status)
+
+    # registered before `trace_requests` so the profile is saved under the request id
+    @app.middleware("http")
+    async def profile_requests(request, call_next):
+        if not should_profile(request) or not active_lock.acquire(blocking=False):
+            return await call_next(request)
+
+        profiler = RequestProfiler()
+        try:
+            profiler.start()
+            try:
+                response = await call_next(request)
+            finally:
+                profiler.stop()
+        finally:
+            active_lock.release()
+
+        request_span = current_span.get()
+        profile_id = f"{request_span.trace_id}-{request_span.span_id}"
+        try:
+            await asyncio.to_thread(profiler.save, profile_id)
+        except Exception:
+            # the request itself succeeded, a profile that cannot be saved (e.g. a full disk) is only logged
+            logger.exception("Profile not saved", extra={"fields": {"profile_id": profile_id}})
+            return response
+        response.headers["X-Profile-ID"] = profile_id
         return response
 
+    # registered last so the request span is the parent of everything else done for the request
+    @app.middleware("http")
+    async def trace_requests(request, call_next):
+        trace_id, parent_id = parse_trace_headers(request.headers)
+        with span(f"{request.method} {request.url.path}", trace_id, parent_id, method=request.method) as item:
+            response = await call_next(request)
+            route = getattr(request.scope.get("route"), "path", None)
+            if route:
+                item.name = f"{request.method} {route}"
+            item.attributes["status_code"] = response.status_code
+            response.headers["X-Request-ID"] = item.trace_id
+            response.headers["traceparent"] = item.traceparent
+            return response
+
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=s.compression_minimum_size,
+        gzip_level=s.gzip_level,
+        brotli_quality=s.brotli_quality,
+    )
+
     app.include_router(users_router, prefix="/users", tags=["Users"])
     app.include_router(chat_info_router, prefix="/chats", tags=["Chats"])
     app.include_router(tickets_router, prefix="/tickets", tags=["Tickets"])
     app.include_router(auth_router, prefix="/auth", tags=["Auth"])
+    app.include_router(metrics_router, prefix="/metrics", tags=["Metrics"])
+    app.include_router(health_router, prefix="/ready", tags=["Health"])
+    app.include_router(debug_router, prefix="/debug", tags=["Debug"])
+    app.include_router(dashboard_router, prefix="/dashboard", tags=["Dashboard"])
 
     return app
 
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from app.metrics.registry import EVENT_LOOP_BLOCKED, EVENT_LOOP_LAG
+
+
+class LoopLagMonitor:
+    """
+    Measure how late the event loop wakes up a sleeping task and record it in `EVENT_LOOP_LAG`.
+    A watchdog thread logs the stack of the loop thread when the loop has not ticked for `block_threshold` seconds,
+    which points at the synchronous call holding the loop.
+    Only uses the standard library and the metrics registry, so the bots can run it without the api settings.
+    With `report_interval` the mean and max lag are also logged every `report_interval` seconds, for the bots
+    which do not serve `/metrics`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        interval: float = 0.1,
+        block_threshold: float = 0.5,
+        logger: logging.Logger = None,
+        report_interval: float = 0,
+    ):
+        self.name = name
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.logger = logger or logging.getLogger("main")
+        self.report_interval = report_interval
+        self.lags = []
+        self.blocked = 0
+        self.last_tick = time.monotonic()
+        self.loop_thread_id = None
+        self.task = None
+        self.watchdog = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        """
+        Start monitoring the running loop, must be called from a coroutine
+        """
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self.stopped.clear()
+        self.task = asyncio.get_running_loop().create_task(self.measure())
+        self.watchdog = threading.Thread(target=self.watch, name=f"{self.name}-loop-watchdog", daemon=True)
+        self.watchdog.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def measure(self):
+        reported = time.monotonic()
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_tick = time.monotonic()
+            lag = max(self.last_tick - start - self.interval, 0)
+            EVENT_LOOP_LAG.observe(lag, process=self.name)
+
+            if not self.report_interval:
+                continue
+            self.lags.append(lag)
+            if self.last_tick - reported >= self.report_interval:
+                self.report()
+                reported = self.last_tick
+
+    def report(self):
+        lags, blocked = self.lags, self.blocked
+        self.lags, self.blocked = [], 0
+        if lags:
+            self.logger.info(
+                f"Event loop lag of {self.name}: mean {sum(lags) / len(lags) * 1000:.2f} ms, "
+                f"max {max(lags) * 1000:.2f} ms over {len(lags)} samples, blocked {blocked} times"
+            )
+
+    def watch(self):
+        reported_tick = None
+        while not self.stopped.wait(self.block_threshold / 2):
+            tick = self.last_tick
+            blocked = time.monotonic() - tick
+            # one report per blocking call, the loop has not ticked again since the last one
+            if blocked < self.block_threshold or tick == reported_tick:
+                continue
+            reported_tick = tick
+
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<loop thread not found>"
+            EVENT_LOOP_BLOCKED.inc(process=self.name)
+            self.blocked += 1
+            self.logger.warning(f"Event loop of {self.name} blocked for {blocked:.3f}s, loop thread stack:\n{stack}")
@@ -0,0 +1,166 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+registry: List["Metric"] = []
+
+
+def format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(ABC):
+    """
+    Minimal prometheus style metric, rendered in the text exposition format by `render_metrics`
+    """
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()  # sheets calls are observed from worker threads
+        registry.append(self)
+
+    def label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """
+        The sample lines of the metric, without the HELP and TYPE lines
+        """
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, label_names)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            return [f"{self.name}{format_labels(self.label_names, k)} {v}" for k, v in self.values.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.label_values(labels)] = value
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = None
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets or DEFAULT_BUCKETS))
+        self.values = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            data = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of the block, a `status` label is filled with `ok` or `error` when not given
+        """
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            if "status" in self.label_names:
+                labels.setdefault("status", status)
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for key, data in self.values.items():
+                for bound, count in zip(self.buckets + ("+Inf",), data[: len(self.buckets)] + [data[-1]]):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{format_labels(self.label_names, key, le)} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {data[-2]}")
+                lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {data[-1]}")
+        return lines
+
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+# metrics shared across the app
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route and status", ("method", "route", "status")
+)
+MONGO_OPERATION_LATENCY = Histogram(
+    "mongo_operation_duration_seconds", "MongoDB operation latency", ("operation", "collection")
+)
+TELEGRAM_REQUEST_LATENCY = Histogram(
+    "telegram_request_duration_seconds", "Telegram bot api call latency", ("method", "status")
+)
+TELEGRAM_ERRORS = Counter("telegram_errors_total", "Telegram bot api errors by error type", ("method", "error"))
+SHEETS_OPERATION_LATENCY = Histogram(
+    "sheets_operation_duration_seconds", "Google Sheets call latency", ("operation", "status")
+)
+SINGLE_FLIGHT_SHARED = Counter(
+    "single_flight_shared_total", "Reads served by joining an identical in-flight query", ("name",)
+)
+BROADCASTS_IN_FLIGHT = Gauge("broadcasts_in_flight", "Ticket broadcasts currently being executed", ("action",))
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay between when a sleeping task should wake up and when the event loop ran it",
+    ("process",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+EVENT_LOOP_BLOCKED = Counter(
+    "event_loop_blocked_total", "Times the event loop was blocked longer than the threshold", ("process",)
+)
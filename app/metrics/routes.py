@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.auth.services import verify_api_key
+from app.metrics.registry import render_metrics
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.get("", response_class=PlainTextResponse)
+async def get_metrics_route():
+    try:
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rendering metrics: {e}")
@@ -0,0 +1,37 @@
+from typing import Any
+
+import orjson
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+def encode_default(obj: Any) -> Any:
+    # only reached for types orjson does not support natively, e.g. pandas Timestamp
+    return jsonable_encoder(obj)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    orjson based response, used as the default response class of the app.
+    Routes return it directly with the raw mongo documents, so FastAPI skips `jsonable_encoder` on the payload.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content, default=encode_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
+
+
+def make_etag(name: str, version: str) -> str:
+    # weak etag, the same data can be sent with different content encodings
+    return f'W/"{name}-{version}"'
+
+
+def not_modified(request: Request, etag: str) -> Response:
+    """
+    Return a 304 response when the client already has the `etag` version, otherwise None
+    """
+    if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
@@ -0,0 +1,232 @@
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pyarrow.dataset as ds
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.analytics import ANALYTICS_SOURCES
+from app.chat_info.services import plan_chat_pull
+from app.responses import FastJSONResponse
+from app.tickets.models import TicketAction
+from app.tickets.services import TICKET_EXPORTS
+
+
+def ticket_records(num: int, chat_num: int) -> list:
+    # shaped like the documents returned by `/tickets/info` and `/chats/info`
+    chats = [
+        {"chat_id": f"-100{i}", "chat_name": f"Chat {i}", "message_id": str(i), "status": True} for i in range(chat_num)
+    ]
+    return [
+        {
+            "ticket_id": f"POST-{i:032x}",
+            "action": "post_annc",
+            "status": "approved",
+            "creator_id": "12345",
+            "creator_name": "Test User",
+            "annc_type": "text",
+            "content_text": "test content " * 20,
+            "content_html": "<b>test content</b> " * 20,
+            "category": ["test_channel"],
+            "language": ["en"],
+            "label": [],
+            "approver_name": "Test Approver",
+            "created_timestamp": 1700000000000 + i,
+            "updated_timestamp": 1700000000000 + i,
+            "status_changed_timestamp": 1700000000000 + i,
+            "chats": chats,
+            "success_chats": chats,
+            "failed_chats": [],
+        }
+        for i in range(num)
+    ]
+
+
+def measure(func, rounds: int = 5) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def test_serialization_output():
+    """
+    `FastJSONResponse` gives the same body with or without `jsonable_encoder`
+    """
+    payload = {"status": 1, "data": ticket_records(num=50, chat_num=10)}
+    assert FastJSONResponse(payload).body == FastJSONResponse(jsonable_encoder(payload)).body
+
+
+@pytest.mark.benchmark
+def test_serialization_benchmark():
+    """
+    Compare the default FastAPI path (`jsonable_encoder` + json) with returning `FastJSONResponse` directly
+    """
+    payload = {"status": 1, "data": ticket_records(num=500, chat_num=50)}
+
+    default_cost = measure(lambda: JSONResponse(jsonable_encoder(payload)))
+    fast_cost = measure(lambda: FastJSONResponse(payload))
+    print(f"\nserialization: jsonable_encoder + json {default_cost * 1000:.2f} ms, orjson {fast_cost * 1000:.2f} ms")
+
+    assert fast_cost < default_cost
+
+
+def test_import_time_benchmark():
+    """
+    Import the app in a fresh interpreter, external clients and the heavy dashboard / telegram dependencies
+    must not be loaded until they are used
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import app.main\n"
+        "print(time.perf_counter() - start)\n"
+        "print(','.join(m for m in ('pandas', 'pygsheets', 'telegram') if m in sys.modules))"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+    cost, loaded = result.stdout.splitlines()
+    print(f"\nimport app.main: {float(cost) * 1000:.2f} ms")
+
+    assert loaded == ""
+
+
+def pandas_ticket_export(documents: list, spec) -> list:
+    # the per-row pandas transform the ticket dashboard used before the export specs
+    import pandas as pd
+
+    tickets = pd.DataFrame(documents)
+    tickets["created_timestamp"] = pd.to_datetime(tickets["created_timestamp"], unit="ms")
+    tickets["status_changed_timestamp"] = pd.to_datetime(tickets["status_changed_timestamp"], unit="ms")
+    for column in ["chats", "success_chats", "failed_chats"]:
+        tickets[column] = tickets[column].apply(lambda x: ", ".join([c["chat_name"] for c in x]))
+    tickets = tickets.rename(columns={column.field: column.title for column in spec.columns}).fillna("")
+    return tickets[spec.header].fillna("").astype(str).values.tolist()
+
+
+def test_ticket_export_output():
+    """
+    The export spec gives the same rows as the pandas transform
+    """
+    documents = ticket_records(num=200, chat_num=10)
+    spec = TICKET_EXPORTS[TicketAction.post_annc]
+    assert spec.to_rows(documents) == pandas_ticket_export(documents, spec)
+
+
+@pytest.mark.benchmark
+def test_ticket_export_benchmark():
+    """
+    Compare the pandas transform with the export spec, time and peak memory
+    """
+    documents = ticket_records(num=5000, chat_num=100)
+    spec = TICKET_EXPORTS[TicketAction.post_annc]
+
+    def pandas_export():
+        return pandas_ticket_export(documents, spec)
+
+    def peak_memory(func) -> int:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    pandas_cost, spec_cost = measure(pandas_export, rounds=3), measure(lambda: spec.to_rows(documents), rounds=3)
+    pandas_peak, spec_peak = peak_memory(pandas_export), peak_memory(lambda: spec.to_rows(documents))
+    print(
+        f"\nticket export: pandas {pandas_cost * 1000:.2f} ms {pandas_peak / 2**20:.1f} MiB, "
+        f"spec {spec_cost * 1000:.2f} ms {spec_peak / 2**20:.1f} MiB"
+    )
+
+    assert spec_cost < pandas_cost
+    assert spec_peak < pandas_peak
+
+
+def chat_pull_table(num: int) -> tuple:
+    # a chat sheet and the db chats it was pushed from, with every 10th chat given a second category on the sheet
+    header = ["Name", "Type", "Added Time", "Label", "Language", "Channel A", "Channel B", "Description"]
+    rows = [[f"Chat {i}", "group", "2023-10-20 10:30:00", "label_1", "en", "V", "", ""] for i in range(num)]
+    chats = [
+        {
+            "chat_id": f"-100{i}",
+            "name": f"Chat {i}",
+            "chat_type": "group",
+            "language": ["en"],
+            "category": ["channel_a"],
+            "label": ["label_1"],
+            "created_timestamp": 1700000000000,
+            "updated_timestamp": 1700000000000,
+        }
+        for i in range(num)
+    ]
+    for row in rows[::10]:
+        row[6] = "V"
+    return header, rows, chats
+
+
+def test_chat_pull_output():
+    """
+    Join a chat sheet to the db chats, only the edited chats are written back
+    """
+    num = 5000
+    header, rows, chats = chat_pull_table(num)
+    updates, results = plan_chat_pull(header, rows, chats)
+
+    assert len(updates) == num // 10
+    assert results[0]["category"] == ["channel_a", "channel_b"]
+    assert plan_chat_pull(header, rows[:1], chats[1:]) == ([], [])
+
+
+@pytest.mark.benchmark
+def test_chat_pull_benchmark():
+    """
+    Join a 5,000 row chat sheet to the db chats within a second of cpu time
+    """
+    num = 5000
+    header, rows, chats = chat_pull_table(num)
+
+    start = time.process_time()
+    updates, _ = plan_chat_pull(header, rows, chats)
+    cost = time.process_time() - start
+    print(f"\nchat pull of {num} chats: {cost * 1000:.2f} ms cpu, {len(updates)} changed")
+
+    assert cost < 1
+
+
+def test_analytics_export_output(tmp_path):
+    """
+    Write a ticket batch to the tickets and deliveries parquet datasets, one delivery row per chat
+    """
+    num, chat_num = 200, 20
+    written = {
+        table.name: table.write(str(tmp_path), ticket_records(num, chat_num), "0")
+        for table in ANALYTICS_SOURCES["ticket_records"]
+    }
+
+    assert written == {"tickets": num, "deliveries": num * chat_num}
+    deliveries = ds.dataset(str(tmp_path / "deliveries"), partitioning="hive").to_table()
+    assert deliveries.num_rows == num * chat_num
+    assert set(deliveries.column("outcome").to_pylist()) == {"success"}
+
+
+@pytest.mark.benchmark
+def test_analytics_export_benchmark(tmp_path):
+    """
+    Write one 5,000 ticket batch, with 20 chats each, to the tickets and deliveries parquet datasets
+    """
+    num, chat_num = 5000, 20
+    tickets = ticket_records(num, chat_num)
+
+    start = time.perf_counter()
+    written = {table.name: table.write(str(tmp_path), tickets, "0") for table in ANALYTICS_SOURCES["ticket_records"]}
+    cost = time.perf_counter() - start
+    print(f"\nanalytics export of {num} tickets: {cost * 1000:.2f} ms, {written}")
+
+    assert written == {"tickets": num, "deliveries": num * chat_num}
+    assert cost < 5
@@ -1,14 +1,49 @@
 import asyncio
-
+import json
+import logging
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import pyarrow.dataset as ds
 import pytest
 from dotenv import load_dotenv
 from httpx import ASGITransport, AsyncClient
-
-from app.auth.services import create_api_key
+from pymongo.errors import DuplicateKeyError
+
+from app import tracing
+from app.analytics import AnalyticsExporter
+from app.auth.services import (
+    create_api_key,
+    invalidate_api_key_cache,
+    key_cache,
+    revoke_api_key,
+)
+from app.chat_info import services as chat_info_services
 from app.config.setting import Settings
-from app.db.dashboard import GCClient
+from app.config.setting import settings as s
+from app.dashboard import sync as dashboard_sync
+from app.dashboard.sync import DashboardJob
+from app.db.dashboard import (
+    AsyncGCClient,
+    GCClient,
+    create_dashboard_client,
+    dataframe_rows,
+    diff_rows,
+    to_runs,
+)
 from app.db.database import MongoClient
-from app.main import create_app
+from app.db.local_dashboard import LocalDashboardClient
+from app.db.single_flight import SingleFlight
+from app.debug import profiler
+from app.health import warmup
+from app.health.warmup import readiness, warm_up
+from app.main import JsonFormatter, JsonQueueHandler, create_app
+from app.metrics.loop_monitor import LoopLagMonitor
+from app.metrics.registry import EVENT_LOOP_BLOCKED, render_metrics
+from app.tickets import services as ticket_services
+from app.users import services as users_services
 
 load_dotenv()
 
@@ -32,6 +67,7 @@ async def clean_db(test_settings):
     await client.delete_many("keys", {})
     await client.delete_many("chat_info", {})
     await client.delete_many("ticket_records", {})
+    invalidate_api_key_cache()
     yield
     await client.close()
 
@@ -55,6 +91,273 @@ def event_loop():
     loop.close()
 
 
+# Auth related test
+@pytest.mark.asyncio
+async def test_verify_api_key(test_client, auth_headers, clean_db):
+    """
+    1. request with a wrong secret is rejected even after the key is cached
+    2. revoked key is rejected right away
+    """
+    res = await test_client.get("/users/info", headers=auth_headers)
+    assert res.status_code == 200
+
+    wrong_headers = {**auth_headers, "X-API-SECRET": "wrong_secret"}
+    res = await test_client.get("/users/info", headers=wrong_headers)
+    assert res.status_code == 403
+
+    client = MongoClient(Settings().dev_db)
+    key = await client.find_one("keys", {"api_key": auth_headers["X-API-KEY"]})
+    assert "api_secret" not in key
+    assert key["api_secret_hash"] != auth_headers["X-API-SECRET"]
+
+    await revoke_api_key(name="test_key")
+    res = await test_client.get("/users/info", headers=auth_headers)
+    assert res.status_code == 403
+    return
+
+
+@pytest.mark.asyncio
+async def test_rate_limit(test_client, auth_headers, clean_db):
+    """
+    1. lower the rate limit of the test key
+    2. requests over the burst get 429 with `Retry-After`
+    3. throttled requests are counted in `/auth/usage`
+    """
+    client = MongoClient(Settings().dev_db)
+    await client.update_one(
+        "keys", {"api_key": auth_headers["X-API-KEY"]}, {"rate_limit": 0.1, "rate_burst": 3, "max_concurrency": 0}
+    )
+    invalidate_api_key_cache(auth_headers["X-API-KEY"])
+
+    status_codes = []
+    for _ in range(4):
+        res = await test_client.get("/users/info", headers=auth_headers)
+        status_codes.append(res.status_code)
+    assert status_codes == [200, 200, 200, 429]
+    assert int(res.headers["Retry-After"]) > 0
+
+    await client.update_one("keys", {"api_key": auth_headers["X-API-KEY"]}, {"rate_limit": 0})
+    invalidate_api_key_cache(auth_headers["X-API-KEY"])
+    res = await test_client.get("/auth/usage", headers=auth_headers)
+    assert res.status_code == 200
+    assert res.json()["data"]["test_key"]["rate_limited"] >= 1
+    return
+
+
+@pytest.mark.asyncio
+async def test_log_non_json_body(test_client, auth_headers, clean_db):
+    """
+    Request logging should not parse the body, so a non-json body reaches the route validation
+    """
+    res = await test_client.post("/users/create", content=b"not a json body", headers=auth_headers)
+    assert res.status_code == 422
+    return
+
+
+@pytest.mark.asyncio
+async def test_metrics(test_client, auth_headers, clean_db):
+    res = await test_client.get("/users/info", headers=auth_headers)
+    assert res.status_code == 200
+
+    res = await test_client.get("/metrics", headers=auth_headers)
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/users/info",status="200"}' in res.text
+    assert 'mongo_operation_duration_seconds_count{operation="find_many",collection="permission"}' in res.text
+    return
+
+
+@pytest.mark.asyncio
+async def test_ready(test_client, auth_headers, clean_db):
+    """
+    1. not ready before the warm-up ran
+    2. after the warm-up every dependency reports its latency and the app is ready
+    3. the api key is primed into the cache
+    """
+    readiness.reset()
+    res = await test_client.get("/ready")
+    assert res.status_code == 503
+
+    await warm_up()
+    res = await test_client.get("/ready")
+    assert res.status_code == 200
+    data = res.json()["data"]
+    assert data["ready"]
+    assert set(data["dependencies"]) == {"mongo", "auth_cache", "sheets", "telegram"}
+    assert all(dep["status"] == "ok" and dep["latency_ms"] >= 0 for dep in data["dependencies"].values())
+    assert auth_headers["X-API-KEY"] in key_cache
+
+
+@pytest.mark.asyncio
+async def test_warm_up_retry(test_client, monkeypatch):
+    """
+    a warm-up failing at startup is retried until it succeeds, `/ready` reports the error meanwhile
+    """
+    calls = []
+
+    async def flaky():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise ConnectionError("not yet")
+
+    monkeypatch.setattr(warmup, "WARM_UPS", {"flaky": flaky})
+    monkeypatch.setattr(s, "warm_up_retry_delay", 0.05)
+    readiness.reset()
+    task = asyncio.create_task(warm_up())
+    await asyncio.sleep(0.01)
+    res = await test_client.get("/ready")
+    assert res.status_code == 503
+    assert res.json()["data"]["dependencies"]["flaky"]["status"] == "error"
+
+    result = await asyncio.wait_for(task, timeout=5)
+    assert result["ready"] and result["dependencies"]["flaky"]["attempts"] == 3
+    # the delay doubles after each failure
+    assert calls[2] - calls[1] > calls[1] - calls[0]
+
+
+def test_trace_file_rotation(tmp_path):
+    """
+    the span file is rotated before it grows past `max_bytes`, only `backups` older files are kept
+    """
+    path = tmp_path / "traces.jsonl"
+    exporter = tracing.JsonFileExporter(str(path), max_bytes=1000, backups=2)
+    span = {"trace_id": "0" * 32, "name": "x" * 200}
+    for _ in range(20):
+        exporter.export([span])
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["traces.jsonl", "traces.jsonl.1", "traces.jsonl.2"]
+    assert all(p.stat().st_size <= 1000 for p in tmp_path.iterdir())
+
+
+@pytest.mark.asyncio
+async def test_request_tracing(test_client, auth_headers, clean_db, monkeypatch):
+    """
+    1. the trace id of the `traceparent` header is returned as `X-Request-ID`
+    2. the mongo calls of the request are recorded as children of the request span
+    """
+    spans = []
+    monkeypatch.setattr(tracing, "processor", SimpleNamespace(on_end=lambda item: spans.append(item.to_dict())))
+
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    headers = {**auth_headers, "traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"}
+    res = await test_client.get("/users/info", headers=headers)
+    assert res.status_code == 200
+    assert res.headers["X-Request-ID"] == trace_id
+
+    request_span = next(item for item in spans if item["name"] == "GET /users/info")
+    assert request_span["trace_id"] == trace_id and request_span["parent_id"] == "00f067aa0ba902b7"
+    mongo_spans = [item for item in spans if item["name"].startswith("mongo.")]
+    assert mongo_spans
+    assert all(item["trace_id"] == trace_id for item in mongo_spans)
+    assert any(item["parent_id"] == request_span["span_id"] for item in mongo_spans)
+    assert "GET /users/info" in tracing.render_timeline([item for item in spans if item["trace_id"] == trace_id])
+
+
+@pytest.mark.asyncio
+async def test_profile_request(test_client, auth_headers, clean_db, monkeypatch):
+    """
+    1. request with the profiling token is profiled and saved under its request id
+    2. the profile is listed and can be downloaded from `/debug/profiles`
+    3. a wrong token is not profiled
+    """
+    monkeypatch.setattr(s, "profiling_token", "test_profiling_token")
+
+    res = await test_client.get("/users/info", headers={**auth_headers, "X-Profile": "test_profiling_token"})
+    assert res.status_code == 200
+    profile_id = res.headers["X-Profile-ID"]
+    assert profile_id.startswith(res.headers["X-Request-ID"])
+
+    res = await test_client.get("/debug/profiles", headers=auth_headers)
+    assert res.status_code == 200
+    assert profile_id in [profile["profile_id"] for profile in res.json()["data"]]
+
+    res = await test_client.get(f"/debug/profiles/{profile_id}", headers=auth_headers)
+    assert res.status_code == 200
+    assert len(res.content) > 0
+
+    res = await test_client.get("/users/info", headers={**auth_headers, "X-Profile": "wrong_token"})
+    assert "X-Profile-ID" not in res.headers
+
+    # a profile that cannot be saved does not fail the request
+    def save(self, profile_id):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(profiler.RequestProfiler, "save", save)
+    res = await test_client.get("/users/info", headers={**auth_headers, "X-Profile": "test_profiling_token"})
+    assert res.status_code == 200
+    assert "X-Profile-ID" not in res.headers
+
+
+def test_remove_old_profiles(tmp_path, monkeypatch):
+    """
+    saves finishing together remove the old profiles without failing on files another one already removed
+    """
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(s, "profiling_max_files", 2)
+    for i in range(10):
+        (tmp_path / f"{i:032x}-{i:016x}.pstats").write_bytes(b"")
+    (tmp_path / f"{10:032x}-{10:016x}.pstats.tmp").write_bytes(b"")
+
+    threads = [threading.Thread(target=profiler.remove_old_profiles) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(profiler.list_profiles()) == 2
+
+
+def test_json_queue_handler():
+    """
+    the traceback of a record passed through the queue is kept in its own field, the message stays clean
+    """
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger("test_json_queue")
+    logger.propagate = False
+    logger.addHandler(JsonQueueHandler(log_queue))
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("Failed %s", "job", extra={"fields": {"job": "sync"}})
+    logger.handlers.clear()
+
+    data = json.loads(JsonFormatter().format(log_queue.get_nowait()))
+    assert data["message"] == "Failed job" and data["job"] == "sync"
+    assert data["exc_info"].startswith("Traceback") and "ValueError: boom" in data["exc_info"]
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor(caplog):
+    """
+    1. a synchronous sleep in a coroutine is recorded as loop lag
+    2. the stack of the blocking call is logged
+    """
+    monitor = LoopLagMonitor("test_loop", interval=0.05, block_threshold=0.2, logger=logging.getLogger("test_loop"))
+    monitor.start()
+    await asyncio.sleep(0.1)
+    with caplog.at_level(logging.WARNING, logger="test_loop"):
+        time.sleep(0.5)
+        await asyncio.sleep(0.2)
+    monitor.stop()
+
+    assert EVENT_LOOP_BLOCKED.values[("test_loop",)] >= 1
+    assert "test_loop_lag_monitor" in caplog.text
+    assert 'event_loop_lag_seconds_count{process="test_loop"}' in render_metrics()
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_report(caplog):
+    """
+    with `report_interval` the lag is logged periodically, as the bots serve no `/metrics`
+    """
+    monitor = LoopLagMonitor("test_report", interval=0.01, logger=logging.getLogger("test_report"), report_interval=0.1)
+    with caplog.at_level(logging.INFO, logger="test_report"):
+        monitor.start()
+        await asyncio.sleep(0.25)
+        monitor.stop()
+
+    assert "Event loop lag of test_report: mean" in caplog.text
+
+
 # User related endpoint
 @pytest.mark.asyncio
 async def test_create_user(test_client, auth_headers, clean_db):
@@ -336,6 +639,193 @@ async def test_delete_chat(test_client, auth_headers, clean_db):
     return
 
 
+@pytest.mark.asyncio
+async def test_chat_info_single_flight(test_client, auth_headers, clean_db, monkeypatch):
+    """
+    1. 10 identical concurrent `/chats/info` requests are served by one db query
+    2. a different query is not coalesced with them
+    """
+    res = await test_client.post(
+        "/chats/create",
+        json={"chat_id": "test_chat_id", "name": "Test Chat", "chat_type": "group", "category": ["test_channel"]},
+        headers=auth_headers,
+    )
+    assert res.status_code == 200
+
+    queries = []
+    find_many = chat_info_services.client.find_many
+
+    async def slow_find_many(*args, **kwargs):
+        queries.append(kwargs.get("query"))
+        await asyncio.sleep(0.2)
+        return await find_many(*args, **kwargs)
+
+    monkeypatch.setattr(chat_info_services.client, "find_many", slow_find_many)
+    params = [{"active": True, "category": ["test_channel", "other"]}] * 5
+    params += [{"category": ["other", "test_channel"], "active": True}] * 5
+    params += [{"active": False}]
+    responses = await asyncio.gather(*[test_client.get("/chats/info", headers=auth_headers, params=p) for p in params])
+    assert all(res.status_code == 200 for res in responses)
+    assert len(queries) == 2
+    assert all(res.json()["data"] == responses[0].json()["data"] for res in responses[:10])
+    assert len(responses[0].json()["data"]) == 1
+    assert responses[-1].json()["data"] == []
+
+
+@pytest.mark.asyncio
+async def test_single_flight_invalidate():
+    """
+    1. a call started before `invalidate` is not joined by later calls
+    2. the callers of a shared call get their own copy of the result
+    """
+    flight = SingleFlight("test")
+    calls = []
+
+    async def query():
+        calls.append(len(calls) + 1)
+        version = calls[-1]
+        await asyncio.sleep(0.1)
+        return [{"version": version, "label": []}]
+
+    first = asyncio.ensure_future(flight.do("key", query))
+    second = asyncio.ensure_future(flight.do("key", query))
+    await asyncio.sleep(0.01)
+    flight.invalidate()
+    after_write = await flight.do("key", query)
+    first, second = await first, await second
+
+    assert len(calls) == 2 and after_write == [{"version": 2, "label": []}]
+    assert first == second == [{"version": 1, "label": []}]
+    first[0]["label"].append("changed")
+    assert second[0]["label"] == []
+
+
+@pytest.mark.asyncio
+async def test_get_chat_facets(test_client, auth_headers, clean_db):
+    """
+    1. create 3 chats with overlapping category, language and label
+    2. check the facet counts
+    3. deactivate one chat and check the cached facets are refreshed
+    """
+    for i in range(3):
+        chat_data = {
+            "chat_id": f"test_chat_id_{i}",
+            "name": f"Test Chat {i}",
+            "chat_type": "group",
+            "language": ["english"] if i < 2 else ["chinese"],
+            "category": ["test_category", f"test_category_{i}"],
+            "label": ["test_label"],
+        }
+        res = await test_client.post("/chats/create", json=chat_data, headers=auth_headers)
+        assert res.status_code == 200
+
+    res = await test_client.get("/chats/facets", headers=auth_headers)
+    assert res.status_code == 200
+    data = res.json()
+    assert data["status"] == 1
+    assert data["data"]["category"]["test_category"] == 3
+    assert data["data"]["category"]["test_category_1"] == 1
+    assert data["data"]["language"] == {"chinese": 1, "english": 2}
+    assert data["data"]["label"] == {"test_label": 3}
+    assert len(data["data"]["name"]) == 3
+
+    res = await test_client.post(
+        "/chats/update", json={"chat_id": "test_chat_id_0", "active": False}, headers=auth_headers
+    )
+    assert res.status_code == 200
+
+    res = await test_client.get("/chats/facets", headers=auth_headers)
+    assert res.status_code == 200
+    data = res.json()
+    assert data["data"]["category"]["test_category"] == 2
+    assert "test_category_0" not in data["data"]["category"]
+    assert "Test Chat 0" not in data["data"]["name"]
+    return
+
+
+@pytest.mark.asyncio
+async def test_chat_info_etag(test_client, auth_headers, clean_db):
+    """
+    1. same `If-None-Match` returns 304 while nothing changed
+    2. a chat write changes the etag
+    """
+    res = await test_client.get("/chats/info", headers=auth_headers)
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+
+    res = await test_client.get("/chats/info", headers={**auth_headers, "If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+
+    chat_data = {"chat_id": "test_chat_id", "name": "Test Chat", "chat_type": "group"}
+    res = await test_client.post("/chats/create", json=chat_data, headers=auth_headers)
+    assert res.status_code == 200
+
+    res = await test_client.get("/chats/info", headers={**auth_headers, "If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+    assert len(res.json()["data"]) == 1
+    return
+
+
+@pytest.mark.asyncio
+async def test_bump_version_concurrent(clean_db):
+    """
+    concurrent first bumps of a collection keep one version record, every bump gives a new version
+    """
+    client = MongoClient(Settings().dev_db)
+    await client.delete_many(client.versions_collection, {"collection": "test_versions"})
+    versions = await asyncio.gather(*[client.bump_version("test_versions") for _ in range(10)])
+    assert len(set(versions)) == 10
+    assert len(await client.find_many(client.versions_collection, {"collection": "test_versions"})) == 1
+    assert await client.get_version("test_versions") == max(versions, key=lambda v: int(v.split("-")[1]))
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_bump_version_duplicate_retry(monkeypatch):
+    """
+    an upsert losing the race against another first bump fails on the unique index and is retried
+    """
+    upserts, indexes = [], []
+
+    async def find_one_and_update(query, update, upsert, return_document):
+        upserts.append(query)
+        if len(upserts) == 1:
+            raise DuplicateKeyError("E11000 duplicate key error")
+        return {"collection": query["collection"], "epoch": "abcd1234", "version": len(upserts)}
+
+    async def create_index(name, keys, unique=False):
+        indexes.append((name, keys, unique))
+
+    client = MongoClient(Settings().dev_db)
+    monkeypatch.setattr(client, "create_index", create_index)
+    monkeypatch.setattr(client, "get_collection", lambda name: SimpleNamespace(find_one_and_update=find_one_and_update))
+    assert await client.bump_version("test_versions") == "abcd1234-2"
+    assert await client.bump_version("test_versions") == "abcd1234-3"
+    # the unique index is created once, on the first bump
+    assert indexes == [("versions", [("collection", 1)], True)]
+
+
+@pytest.mark.asyncio
+async def test_response_compression(test_client, auth_headers, clean_db):
+    for i in range(50):
+        chat_data = {"chat_id": f"test_chat_id_{i}", "name": f"Test Chat {i}", "chat_type": "group"}
+        res = await test_client.post("/chats/create", json=chat_data, headers=auth_headers)
+        assert res.status_code == 200
+
+    res = await test_client.get("/chats/info", headers={**auth_headers, "Accept-Encoding": "gzip"})
+    assert res.status_code == 200
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert len(res.json()["data"]) == 50
+
+    # small responses are sent as is
+    res = await test_client.get("/users/is_admin", params={"user_id": "1"}, headers=auth_headers)
+    assert res.status_code == 200
+    assert "Content-Encoding" not in res.headers
+    return
+
+
 # Ticket related test
 @pytest.mark.asyncio
 async def test_create_post_ticket(test_client, auth_headers, clean_db):
@@ -592,6 +1082,370 @@ async def test_push_chat_info_dashboard(test_client, auth_headers, clean_db):
     return
 
 
+@pytest.mark.asyncio
+async def test_push_chat_info_dashboard_summary(test_client, auth_headers, clean_db):
+    """
+    1. create 3 chats
+    2. push dashboard in summary mode, only row count and digest are returned
+    3. push again without changes, the digest should stay the same
+    """
+    for i in range(3):
+        chat_data = {
+            "chat_id": f"test_chat_id_{i}",
+            "name": f"Test Chat {i}",
+            "chat_type": "group",
+            "language": ["en"],
+            "category": [f"test_channel_{i}"],
+            "label": ["test_label_1"],
+        }
+        res = await test_client.post("/chats/create", json=chat_data, headers=auth_headers)
+        assert res.status_code == 200
+
+    params = {"direction": "push", "mode": "summary"}
+    res = await test_client.get("/chats/update_dashboard", headers=auth_headers, params=params)
+    assert res.status_code == 200
+    summary = res.json()["data"]
+    assert summary["rows"] == 3
+    assert "digest" in summary and "duration_ms" in summary
+
+    res = await test_client.get("/chats/update_dashboard", headers=auth_headers, params=params)
+    assert res.status_code == 200
+    assert res.json()["data"]["digest"] == summary["digest"]
+
+
+def test_dashboard_diff_rows():
+    """
+    rows are matched by key, only rows that appeared, disappeared or changed are reported,
+    duplicated keys or reordered rows need a full rewrite
+    """
+    old = [["1", "a"], ["2", "b"], ["3", "c"], ["4", "d"]]
+    new = [["0", "z"], ["1", "a"], ["3", "x"], ["4", "d"], ["5", "e"], ["6", "f"]]
+    assert diff_rows(old, new, [0]) == {"deleted": [1], "inserted": [0, 4, 5], "changed": [2]}
+    assert diff_rows(old, old, [0]) == {"deleted": [], "inserted": [], "changed": []}
+    assert diff_rows(old, [["3", "c"], ["1", "a"]], [0]) is None
+    assert diff_rows(old, [["1", "a"], ["1", "b"]], [0]) is None
+    assert to_runs([0, 4, 5, 7]) == [(0, 1), (4, 6), (7, 8)]
+
+
+def test_dashboard_dataframe_rows():
+    """
+    missing values become empty cells, the same text an empty cell reads back as, so unchanged rows compare equal
+    """
+    import pandas as pd
+
+    df = pd.DataFrame({"ID": [1, 2], "Time": pd.to_datetime([1700000000000, None], unit="ms"), "Note": ["a", None]})
+    assert dataframe_rows(df) == (["ID", "Time", "Note"], [["1", "2023-11-14 22:13:20", "a"], ["2", "", ""]])
+
+
+class FakeSheetsApi:
+    """
+    the values and row requests of the Sheets API used by `GCClient.sync_rows`, on grids of strings in memory
+    """
+
+    def __init__(self):
+        self.grids, self.calls = {}, []
+
+    def worksheet(self, sheet_id: int, title: str):
+        self.grids[sheet_id] = [["", ""] for _ in range(3)]
+        return SimpleNamespace(
+            id=sheet_id,
+            title=title,
+            rows=3,
+            cols=2,
+            client=SimpleNamespace(sheet=self),
+            spreadsheet=SimpleNamespace(id="spreadsheet"),
+            jsonSheet={"properties": {"gridProperties": {}}},
+        )
+
+    def values(self, sheet_id: int) -> list:
+        values = [list(row) for row in self.grids[sheet_id]]
+        while values and not any(values[-1]):
+            values.pop()
+        return values
+
+    def values_batch_get(self, spreadsheet_id, ranges):
+        self.calls.append("values_batch_get")
+        return [{"range": r, "values": self.values(int(r.strip("'")[-1]))} for r in ranges]
+
+    def batch_update(self, spreadsheet_id, requests):
+        self.calls.append("batch_update")
+        for request in requests:
+            ((kind, body),) = request.items()
+            grid = self.grids[body["range"]["sheetId"]]
+            start, end = body["range"]["startIndex"], body["range"]["endIndex"]
+            if kind == "deleteDimension":
+                del grid[start:end]
+            else:
+                grid[start:start] = [["", ""] for _ in range(end - start)]
+
+    def values_batch_update_by_data_filter(self, spreadsheet_id, data, parse=True):
+        self.calls.append("values_batch_update")
+        for item in data:
+            r = item["dataFilter"]["gridRange"]
+            for i, row in enumerate(item["values"]):
+                self.grids[r["sheetId"]][r["startRowIndex"] + i][r["startColumnIndex"] : r["endColumnIndex"]] = row
+
+
+def test_dashboard_sync_reads_current_rows():
+    """
+    every sync reads the sheets first, in one call, so a row inserted by hand since the last sync is not shifted
+    over or deleted by a diff against the rows written before
+    """
+    api = FakeSheetsApi()
+    sheets = [api.worksheet(0, "Sheet 0"), api.worksheet(1, "Sheet 1")]
+    gc_client = GCClient()
+    header = ["ID", "Status"]
+
+    gc_client.sync_rows([(sheet, header, [["1", "a"], ["3", "c"]], ["ID"]) for sheet in sheets])
+    assert api.values(0) == api.values(1) == [header, ["1", "a"], ["3", "c"]]
+
+    api.grids[0].insert(2, ["2", "by hand"])
+    api.calls.clear()
+    stats = gc_client.sync_rows(
+        [(sheet, header, [["1", "a"], ["2", "by hand"], ["3", "x"]], ["ID"]) for sheet in sheets]
+    )
+    assert api.calls == ["values_batch_get", "batch_update", "values_batch_update"]
+    assert api.values(0) == api.values(1) == [header, ["1", "a"], ["2", "by hand"], ["3", "x"]]
+    assert stats[0] == {"inserted": 0, "updated": 1, "deleted": 0, "rewritten": False}
+    assert stats[1] == {"inserted": 1, "updated": 1, "deleted": 0, "rewritten": False}
+
+
+def test_dashboard_handles_cache():
+    """
+    the spreadsheet metadata is fetched once for several sheets, and again when a sheet title is not known
+    """
+    calls = []
+    sheets = [SimpleNamespace(title="Edit History")]
+    spreadsheet = SimpleNamespace(id="id", worksheets=lambda: list(sheets))
+    gc_client = GCClient()
+    gc_client._gc_client = SimpleNamespace(open_by_url=lambda url: calls.append(url) or spreadsheet)
+
+    assert gc_client.get_ws("Edit History", to_type="ws") is sheets[0]
+    assert gc_client.get_ws("Edit History", to_type="ws") is sheets[0]
+    assert len(calls) == 1
+
+    sheets.append(SimpleNamespace(title="Delete History"))
+    assert gc_client.get_ws("Delete History", to_type="ws") is sheets[1]
+    assert gc_client.get_ws("Missing", to_type="ws") is None
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_async_gc_client(monkeypatch):
+    """
+    sheets calls run in the thread pool so the event loop keeps running, and slow calls time out
+    """
+    gc_client = AsyncGCClient()
+    monkeypatch.setattr(gc_client.client, "get_ws", lambda name, url, to_type: time.sleep(0.3) or name)
+
+    start = time.perf_counter()
+    task = asyncio.ensure_future(gc_client.get_ws("Edit History", to_type="ws"))
+    await asyncio.sleep(0.05)
+    assert time.perf_counter() - start < 0.2
+    assert await task == "Edit History"
+
+    monkeypatch.setattr(s, "sheets_timeout", 0.05)
+    with pytest.raises(TimeoutError):
+        await gc_client.get_ws("Edit History", to_type="ws")
+
+
+@pytest.mark.asyncio
+async def test_async_gc_client_write(monkeypatch):
+    """
+    writes are not timed out, and a cancelled sync returns only once its running write is done,
+    so the sheet lock held by the caller is not released while the thread still writes
+    """
+    writes = []
+    gc_client = AsyncGCClient()
+    monkeypatch.setattr(s, "sheets_timeout", 0.05)
+    monkeypatch.setattr(gc_client.client, "sync_rows", lambda tables: time.sleep(0.2) or writes.append(tables))
+
+    await gc_client.sync_rows(["first"])
+    assert writes == [["first"]]
+
+    task = asyncio.ensure_future(gc_client.sync_rows(["second"]))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert writes == [["first"], ["second"]]
+
+
+@pytest.mark.asyncio
+async def test_dashboard_sync_job():
+    """
+    a burst of dirty signals is synced once, pull before push, and syncs never overlap
+    """
+    calls = []
+    running = []
+
+    async def sync(step):
+        running.append(step)
+        assert len(running) == 1
+        await asyncio.sleep(0.01)
+        calls.append(step)
+        running.pop()
+
+    job = DashboardJob("chats", sync, window=0.05, steps=("pull", "push"))
+    for _ in range(5):
+        job.mark_dirty("push")
+        job.mark_dirty("pull")
+    assert job.status()["pending"] == ["pull", "push"]
+    with pytest.raises(ValueError):
+        job.mark_dirty("merge")
+
+    async with job.syncing():
+        await sync("pull")
+    await job.task
+    assert calls == ["pull", "pull", "push"]
+    status = job.status()
+    assert status["signals"] == 10 and status["syncs"] == 2 and status["pending"] == []
+    assert status["last_sync"] is not None and status["last_error"] is None
+
+
+@pytest.mark.asyncio
+async def test_dashboard_sync_flush(monkeypatch, caplog):
+    """
+    on shutdown a pending sync runs right away instead of after the window, one that does not finish in time
+    is cancelled and logged
+    """
+    calls = []
+
+    async def sync(step):
+        calls.append(step)
+
+    async def slow_sync(step):
+        await asyncio.sleep(10)
+
+    fast = DashboardJob("fast", sync, window=60)
+    slow = DashboardJob("slow", slow_sync, window=60)
+    monkeypatch.setattr(dashboard_sync, "jobs", {"fast": fast, "slow": slow})
+    fast.mark_dirty()
+    slow.mark_dirty()
+    slow.mark_dirty()
+
+    start = time.perf_counter()
+    with caplog.at_level(logging.WARNING, logger="main"):
+        await dashboard_sync.flush_all(timeout=0.2)
+    assert time.perf_counter() - start < 1
+    assert calls == ["sync"] and fast.status()["pending"] == []
+    assert "Cancelled the ['sync'] steps of the queued slow dashboard sync" in caplog.text
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("file_format", ["csv", "parquet"])
+async def test_local_dashboard_backend(tmp_path, file_format):
+    """
+    the local backend keeps each worksheet in a file, with the same reads and writes as the spreadsheet
+    """
+    import pandas as pd
+
+    gc_client = AsyncGCClient(LocalDashboardClient(str(tmp_path), file_format))
+    assert (await gc_client.get_ws("Edit History", to_type="df")).empty
+
+    ws = await gc_client.get_ws("Edit History", to_type="ws")
+    modified_time = await gc_client.get_modified_time()
+    stats = await gc_client.sync_rows([(ws, ["ID", "Status"], [["1", "approved"], ["2", "pending"]], ["ID"])])
+    assert stats[0]["updated"] == 2
+    assert await gc_client.get_values(ws) == (["ID", "Status"], [["1", "approved"], ["2", "pending"]])
+    assert await gc_client.get_modified_time() != modified_time
+
+    await gc_client.sync_dataframe(ws, pd.DataFrame({"ID": [3], "Status": ["rejected"]}), keys=["ID"])
+    df = await gc_client.get_as_df(ws)
+    assert df.to_dict(orient="records") == [{"ID": 3, "Status": "rejected"}]
+
+    other = await gc_client.get_ws("Q&A / 2024", to_type="ws")
+    await gc_client.sync_rows([(other, ["ID"], [["1"]], ["ID"])])
+    titles = [sheet.title for sheet in (await gc_client.open_spreadsheet()).worksheets()]
+    assert sorted(titles) == ["Edit History", "Q&A / 2024"]
+
+    gc_client.client.clear(ws)
+    assert await gc_client.get_values(ws) is None
+
+
+@pytest.mark.asyncio
+async def test_analytics_export(test_client, auth_headers, clean_db, tmp_path):
+    """
+    the export appends the tickets, deliveries and chats updated since its last run to the parquet datasets
+    """
+    chat_data = {"chat_id": "test_chat_id", "name": "Test Chat", "chat_type": "group", "language": ["en"]}
+    res = await test_client.post("/chats/create", json=chat_data, headers=auth_headers)
+    assert res.status_code == 200
+    ticket_data = {
+        "action": "post_annc",
+        "ticket": {
+            "creator_id": "test_user_id",
+            "creator_name": "Test User",
+            "annc_type": "text",
+            "content_text": "test content",
+            "chats": [{"chat_id": "test_chat_id", "chat_name": "Test Chat"}],
+        },
+    }
+    res = await test_client.post("/tickets/create", json=ticket_data, headers=auth_headers)
+    assert res.status_code == 200
+    ticket_id = res.json()["data"]["ticket_id"]
+
+    exporter = AnalyticsExporter(path=str(tmp_path), lag=0)
+    result = await exporter.export()
+    assert result["written"] == {"tickets": 1, "deliveries": 1, "chats": 1}
+    assert exporter.load_state() == result["state"]
+
+    tickets = ds.dataset(str(tmp_path / "tickets"), partitioning="hive").to_table().to_pylist()
+    assert [(t["ticket_id"], t["action"]) for t in tickets] == [(ticket_id, "post_annc")]
+    deliveries = ds.dataset(str(tmp_path / "deliveries"), partitioning="hive").to_table().to_pylist()
+    assert [(d["chat_id"], d["outcome"]) for d in deliveries] == [("test_chat_id", "pending")]
+
+    # nothing changed, nothing is written again
+    await asyncio.sleep(0.01)
+    assert (await exporter.export())["written"] == {"tickets": 0, "deliveries": 0, "chats": 0}
+
+    await asyncio.sleep(0.01)
+    res = await test_client.post(
+        "/chats/update", json={"chat_id": "test_chat_id", "label": ["test_label"]}, headers=auth_headers
+    )
+    assert res.status_code == 200
+    await asyncio.sleep(0.01)
+    assert (await exporter.export())["written"] == {"tickets": 0, "deliveries": 0, "chats": 1}
+    chats = ds.dataset(str(tmp_path / "chats"), partitioning="hive").to_table().to_pylist()
+    latest = max(chats, key=lambda chat: chat["updated_timestamp"])
+    assert len(chats) == 2 and latest["label"] == ["test_label"]
+
+
+@pytest.mark.asyncio
+async def test_analytics_export_retry(tmp_path):
+    """
+    the files of an export failing midway are deleted by the next one, which exports the same documents once
+    """
+    chats = [
+        {"chat_id": str(i), "name": f"Chat {i}", "created_timestamp": ts, "updated_timestamp": ts}
+        for i, ts in enumerate([1700000000000, 1710000000000, 1720000000000])
+    ]
+    state = {"fail": True}
+
+    async def iter_batches(name, query, sort=None, batch_size=1000):
+        documents = [chat for chat in chats if name == "chat_info"]
+        for start in range(0, len(documents), batch_size):
+            if start and state["fail"]:
+                raise ConnectionError("cursor lost")
+            yield documents[start : start + batch_size]
+
+    async def create_index(name, keys):
+        return "updated_timestamp_1"
+
+    client = SimpleNamespace(iter_batches=iter_batches, create_index=create_index)
+    exporter = AnalyticsExporter(client=client, path=str(tmp_path), batch_size=2, lag=0)
+    with pytest.raises(ConnectionError):
+        await exporter.export()
+    assert "chat_info" not in exporter.load_state()
+
+    # the batches of the next run differ, a file the failed run wrote to a month they skip would be a duplicate
+    chats.insert(0, chats.pop())
+    state["fail"] = False
+    assert (await exporter.export())["written"]["chats"] == 3
+    rows = ds.dataset(str(tmp_path / "chats"), partitioning="hive").to_table().to_pylist()
+    assert sorted(row["chat_id"] for row in rows) == ["0", "1", "2"]
+
+
 @pytest.mark.asyncio
 async def test_pull_chat_info_dashboard(test_client, auth_headers, clean_db):
     """
@@ -624,7 +1478,7 @@ async def test_pull_chat_info_dashboard(test_client, auth_headers, clean_db):
     assert "data" in data
     assert len(data["data"]) == chat_num
 
-    gc_client = GCClient()
+    gc_client = create_dashboard_client()
     ws = gc_client.get_ws("TG Chat Info", to_type="ws")
     chat_info = ws.get_as_df()
     chat_info["New Pull Category"] = "V"
@@ -644,6 +1498,193 @@ async def test_pull_chat_info_dashboard(test_client, auth_headers, clean_db):
     return
 
 
+@pytest.mark.asyncio
+async def test_pull_chat_info_dashboard_unchanged(monkeypatch):
+    """
+    a pull is skipped when neither the spreadsheet nor the chats were modified,
+    and the db is not read when the chat sheet is unchanged
+    """
+    calls = []
+    state = {"modified_time": "2024-01-01T00:00:00.000Z", "version": "1"}
+    values = (["Name", "Type", "Label", "Language", "Description"], [["Test Chat", "group", "", "en", ""]])
+
+    async def get_modified_time():
+        return state["modified_time"]
+
+    async def get_ws(name, to_type):
+        return name
+
+    async def get_values(ws):
+        calls.append("get_values")
+        return values
+
+    async def find_many(name, query):
+        calls.append("find_many")
+        return []
+
+    async def get_version(name):
+        return state["version"]
+
+    monkeypatch.setattr(chat_info_services, "last_pull", {"modified_time": None, "digest": None, "version": None})
+    monkeypatch.setattr(
+        chat_info_services,
+        "gc_client",
+        SimpleNamespace(get_modified_time=get_modified_time, get_ws=get_ws, get_values=get_values),
+    )
+    monkeypatch.setattr(chat_info_services.client, "find_many", find_many)
+    monkeypatch.setattr(chat_info_services.client, "get_version", get_version)
+
+    await chat_info_services.update_chat_dashboard("pull")
+    await chat_info_services.update_chat_dashboard("pull")
+    assert calls == ["get_values", "find_many"]
+
+    state["modified_time"] = "2024-01-02T00:00:00.000Z"
+    await chat_info_services.update_chat_dashboard("pull")
+    assert calls == ["get_values", "find_many", "get_values"]
+
+    # a chat written through the api may differ from the unchanged sheet again
+    state["version"] = "2"
+    await chat_info_services.update_chat_dashboard("pull")
+    assert calls == ["get_values", "find_many", "get_values", "get_values", "find_many"]
+
+
+@pytest.mark.asyncio
+async def test_pull_chat_info_dashboard_local(tmp_path, monkeypatch):
+    """
+    the pull reads the chat sheet through the dashboard client, unpacks its header and rows,
+    and writes only the chats whose language, category, label or description changed on the sheet
+    """
+    chats = [
+        {"chat_id": "1", "name": "Chat 1", "chat_type": "group", "language": ["en"], "category": [], "label": []},
+        {"chat_id": "2", "name": "Chat 2", "chat_type": "group", "language": ["en"], "category": [], "label": []},
+    ]
+    updates, reads, versions = [], [], []
+    state = {"concurrent_write": False}
+
+    async def find_many(name, query):
+        reads.append(name)
+        return chats
+
+    async def bulk_update(name, pairs):
+        if state["concurrent_write"]:
+            versions.append("api")
+        updates.extend(pairs)
+        for query, update in pairs:
+            next(chat for chat in chats if chat["chat_id"] == query["chat_id"]).update(update)
+        return len(pairs)
+
+    async def get_version(name):
+        return f"epoch-{len(versions)}"
+
+    async def bump_version(name):
+        versions.append(name)
+        return f"epoch-{len(versions)}"
+
+    gc_client = AsyncGCClient(LocalDashboardClient(str(tmp_path)))
+    monkeypatch.setattr(chat_info_services, "gc_client", gc_client)
+    monkeypatch.setattr(chat_info_services, "last_pull", {"modified_time": None, "digest": None, "version": None})
+    monkeypatch.setattr(chat_info_services.client, "find_many", find_many)
+    monkeypatch.setattr(chat_info_services.client, "bulk_update", bulk_update)
+    monkeypatch.setattr(chat_info_services.client, "get_version", get_version)
+    monkeypatch.setattr(chat_info_services.client, "bump_version", bump_version)
+
+    ws = await gc_client.get_ws("TG Chat Info", to_type="ws")
+    header = ["Name", "Type", "Label", "Language", "News", "Description"]
+    rows = [["Chat 1", "group", "", "en", "", ""], ["Chat 2", "group", "vip", "en, fr", "V", "hello"]]
+    await gc_client.sync_rows([(ws, header, rows, ["Name", "Type"])])
+
+    results = await chat_info_services.update_chat_dashboard("pull")
+    assert [query for query, _ in updates] == [{"chat_id": "2"}]
+    assert [(r["label"], r["language"], r["category"], r["description"]) for r in results] == [
+        (["vip"], ["en", "fr"], ["news"], "hello")
+    ]
+
+    # the version bumped by the pull's own write is recorded, the next pull is skipped
+    assert await chat_info_services.update_chat_dashboard("pull") == []
+    assert len(reads) == 1 and len(updates) == 1
+
+    # a chat written through the api while a pull writes is compared again by the next pull
+    rows[0][2] = "new"
+    await gc_client.sync_rows([(ws, header, rows, ["Name", "Type"])])
+    state["concurrent_write"] = True
+    await chat_info_services.update_chat_dashboard("pull")
+    state["concurrent_write"] = False
+    assert len(reads) == 2 and len(updates) == 2
+    assert await chat_info_services.update_chat_dashboard("pull") == []
+    assert len(reads) == 3
+    assert await chat_info_services.update_chat_dashboard("pull") == []
+    assert len(reads) == 3
+
+
+@pytest.mark.asyncio
+async def test_update_dashboards_local(tmp_path, monkeypatch):
+    """
+    the user, chat and ticket dashboards are pushed to a fresh local dashboard directory, without any sheet yet,
+    and a later chat push keeps the rows of the chats already on the sheet in place
+    """
+    documents = {
+        "permission": [
+            {
+                "user_id": "1",
+                "name": "Admin",
+                "admin": True,
+                "whitelist": False,
+                "created_timestamp": 1700000000000,
+                "updated_timestamp": 1700000000000,
+            }
+        ],
+        "chat_info": [
+            {"chat_id": str(i), "name": f"Chat {i}", "chat_type": "group", "language": ["en"], "category": ["news"]}
+            for i in (1, 2)
+        ],
+        "ticket_records": [
+            {
+                "ticket_id": "t1",
+                "action": "post_annc",
+                "annc_type": "text",
+                "content_text": "hello",
+                "category": ["news"],
+                "status": "pending",
+                "created_timestamp": 1700000000000,
+                "chats": [{"chat_id": "1", "chat_name": "Chat 1"}],
+            }
+        ],
+    }
+
+    async def find_many(name, query, limit=0, sort=None):
+        # the fields a stored chat always has
+        chat = {"language": [], "category": [], "label": [], "description": None, "created_timestamp": 1700000000000}
+        return [{**chat, **document} if name == "chat_info" else document for document in documents[name]]
+
+    gc_client = AsyncGCClient(LocalDashboardClient(str(tmp_path)))
+    for services in (users_services, chat_info_services, ticket_services):
+        monkeypatch.setattr(services, "gc_client", gc_client)
+        monkeypatch.setattr(services.client, "find_many", find_many)
+
+    await users_services.update_user_dashboard()
+    ws = await gc_client.get_ws("TG User Permission", to_type="ws")
+    header, rows = await gc_client.get_values(ws)
+    assert header == ["User Id", "Name", "Admin", "Whitelist", "Created Timestamp", "Updated Timestamp"]
+    assert rows == [["1", "Admin", "V", "", "2023-11-14 22:13:20", "2023-11-14 22:13:20"]]
+
+    await chat_info_services.update_chat_dashboard("push")
+    ws = await gc_client.get_ws("TG Chat Info", to_type="ws")
+    header, rows = await gc_client.get_values(ws)
+    assert header == ["Name", "Type", "Added Time", "Label", "Language", "News", "Description"]
+    assert [row[0] for row in rows] == ["Chat 1", "Chat 2"]
+
+    documents["chat_info"].insert(0, {"chat_id": "3", "name": "Chat 3", "chat_type": "channel"})
+    documents["chat_info"].reverse()
+    await chat_info_services.update_chat_dashboard("push")
+    assert [row[0] for row in (await gc_client.get_values(ws))[1]] == ["Chat 1", "Chat 2", "Chat 3"]
+
+    outputs = await ticket_services.update_ticket_dashboard()
+    ws = await gc_client.get_ws("Announcement History", to_type="ws")
+    header, rows = await gc_client.get_values(ws)
+    assert header == ticket_services.TICKET_EXPORTS["post_annc"].header
+    assert [row[0] for row in rows] == ["t1"] and outputs["edit_tickets"] == []
+
+
 async def test_update_ticket_info(test_client, auth_headers, clean_db):
     """
     This test will try to create and execute a post ticket and update the ticket info the online dashboard
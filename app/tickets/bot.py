@@ -0,0 +1,28 @@
+# app/tickets/bot.py
+from telegram import Bot, request
+from telegram.error import TelegramError
+
+from app.metrics.registry import TELEGRAM_ERRORS, TELEGRAM_REQUEST_LATENCY
+from app.tracing import span
+
+__all__ = ["EventBot", "TelegramError", "call_bot"]
+
+
+class EventBot(Bot):
+    REQUEST = request.HTTPXRequest(connection_pool_size=50000, connect_timeout=300, read_timeout=300)
+
+    def __init__(self, **kwargs):
+        super().__init__(request=self.REQUEST, **kwargs)
+
+
+async def call_bot(method, **kwargs):
+    """
+    Call a bot api method and record its latency, error type and span
+    """
+    with span(f"telegram.{method.__name__}", chat_id=kwargs.get("chat_id")):
+        with TELEGRAM_REQUEST_LATENCY.time(method=method.__name__):
+            try:
+                return await method(**kwargs)
+            except TelegramError as e:
+                TELEGRAM_ERRORS.inc(method=method.__name__, error=type(e).__name__)
+                raise
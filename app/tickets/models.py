@@ -7,20 +7,12 @@ from enum import Enum
 from typing import Dict, List, Optional
 import logging
 from pydantic import BaseModel, Field
-from telegram import Bot, request
-from telegram.error import TelegramError
 
 from app.config.setting import settings as s
+from app.metrics.registry import BROADCASTS_IN_FLIGHT
 from app.users.models import User
 
 
-class EventBot(Bot):
-    REQUEST = request.HTTPXRequest(connection_pool_size=50000, connect_timeout=300, read_timeout=300)
-
-    def __init__(self, **kwargs):
-        super().__init__(request=self.REQUEST, **kwargs)
-
-
 # Enum definitions
 class TicketAction(str, Enum):
     post_annc = "post_annc"
@@ -71,7 +63,8 @@ class Ticket(TimestampModel):
     status_changed_timestamp: Optional[int] = None
 
     async def approve(self, user: User):
-        params = await self.execute()
+        with BROADCASTS_IN_FLIGHT.track_in_progress(action=self.action.value):
+            params = await self.execute()
         params.update(
             {
                 "approver_id": user.user_id,
@@ -127,20 +120,34 @@ class PostTicket(Ticket):
             self.ticket_id = f"POST-{self._id}"
 
     async def execute(self):
+        # telegram is slow to import, it is only loaded once a ticket is executed
+        from app.tickets.bot import EventBot, TelegramError, call_bot
+
         async def send_message(chat):
             try:
                 if self.annc_type == AnncType.text:
-                    message = await bot.send_message(chat_id=chat["chat_id"], text=self.content_html, parse_mode="HTML")
+                    message = await call_bot(
+                        bot.send_message, chat_id=chat["chat_id"], text=self.content_html, parse_mode="HTML"
+                    )
                 elif self.annc_type == AnncType.image:
-                    message = await bot.send_photo(
-                        chat_id=chat["chat_id"], photo=self.file_path, caption=self.content_html, parse_mode="HTML"
+                    message = await call_bot(
+                        bot.send_photo,
+                        chat_id=chat["chat_id"],
+                        photo=self.file_path,
+                        caption=self.content_html,
+                        parse_mode="HTML",
                     )
                 elif self.annc_type == AnncType.video:
-                    message = await bot.send_video(
-                        chat_id=chat["chat_id"], video=self.file_path, caption=self.content_html, parse_mode="HTML"
+                    message = await call_bot(
+                        bot.send_video,
+                        chat_id=chat["chat_id"],
+                        video=self.file_path,
+                        caption=self.content_html,
+                        parse_mode="HTML",
                     )
                 else:
-                    message = await bot.send_document(
+                    message = await call_bot(
+                        bot.send_document,
                         chat_id=chat["chat_id"],
                         document=self.file_path,
                         caption=self.content_html,
@@ -153,7 +160,9 @@ class PostTicket(Ticket):
                     "status": True,
                 }
             except TelegramError as e:
-                logging.error(f"Error sending message to chat {chat['chat_id']}, name: {chat['chat_name']}, error: {str(e)}")
+                logging.error(
+                    f"Error sending message to chat {chat['chat_id']}, name: {chat['chat_name']}, error: {str(e)}"
+                )
                 return {"chat_id": chat["chat_id"], "chat_name": chat["chat_name"], "status": False, "error": str(e)}
 
         bot = EventBot(token=s.event_bot_token)
@@ -197,17 +206,21 @@ class EditTicket(Ticket):
             self.ticket_id = f"EDIT-{self._id}"
 
     async def execute(self):
+        from app.tickets.bot import EventBot, TelegramError, call_bot
+
         async def update_message(chat: Dict):
             try:
                 if self.old_annc_type == AnncType.text:
-                    message = await bot.edit_message_text(
+                    message = await call_bot(
+                        bot.edit_message_text,
                         chat_id=chat["chat_id"],
                         message_id=chat["message_id"],
                         text=self.new_content_md,
                         parse_mode="MarkdownV2",
                     )
                 else:
-                    message = await bot.edit_message_caption(
+                    message = await call_bot(
+                        bot.edit_message_caption,
                         chat_id=chat["chat_id"],
                         message_id=chat["message_id"],
                         caption=self.new_content_md,
@@ -265,9 +278,11 @@ class DeleteTicket(Ticket):
             self.ticket_id = f"DELETE-{self._id}"
 
     async def execute(self):
+        from app.tickets.bot import EventBot, TelegramError, call_bot
+
         async def delete_message(chat):
             try:
-                message = await bot.delete_message(chat_id=chat["chat_id"], message_id=chat["message_id"])
+                message = await call_bot(bot.delete_message, chat_id=chat["chat_id"], message_id=chat["message_id"])
                 return {
                     "chat_id": chat["chat_id"],
                     "chat_name": chat["chat_name"],
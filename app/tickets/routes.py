@@ -4,6 +4,9 @@ from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
 
 from app.auth.services import verify_api_key
+from app.dashboard import sync as dashboard_sync
+from app.db.dashboard import DashboardMode
+from app.responses import FastJSONResponse
 from app.tickets.models import (
     ApproveRejectTicketParams,
     CreateTicketParams,
@@ -25,6 +28,7 @@ router = APIRouter(dependencies=[Depends(verify_api_key)])
 
 # below is `get` endpoints
 
+
 # get ticket info
 @router.get("/info")
 async def get_ticket_info_route(
@@ -49,20 +53,26 @@ async def get_ticket_info_route(
     )
     try:
         res = await get_ticket_info(params)
-        return {
-            "status": 1,
-            "data_num": len(res),
-            "data": res,
-        }
+        return FastJSONResponse(
+            {
+                "status": 1,
+                "data_num": len(res),
+                "data": res,
+            }
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting ticket info: {e}")
 
 
 @router.get("/update_dashboard")
-async def update_dashboard_route():
+async def update_dashboard_route(mode: DashboardMode = DashboardMode.full, background: bool = False):
     try:
-        res = await update_ticket_dashboard()
-        return {"status": 1, "data": res}
+        job = dashboard_sync.jobs["tickets"]
+        if background:
+            return FastJSONResponse({"status": 1, "data": job.mark_dirty()})
+        async with job.syncing():
+            res = await update_ticket_dashboard(mode)
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating ticket dashboard: {e}")
 
@@ -72,10 +82,12 @@ async def update_dashboard_route():
 async def create_ticket_route(params: CreateTicketParams):
     try:
         res = await create_ticket(params)
-        return {
-            "status": 1,
-            "data": res,
-        }
+        return FastJSONResponse(
+            {
+                "status": 1,
+                "data": res,
+            }
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating ticket: {e}")
 
@@ -84,10 +96,12 @@ async def create_ticket_route(params: CreateTicketParams):
 async def approve_ticket_route(params: ApproveRejectTicketParams):
     try:
         res = await approve_ticket(params.ticket_id, params.user_id)
-        return {
-            "status": 1,
-            "data": res,
-        }
+        return FastJSONResponse(
+            {
+                "status": 1,
+                "data": res,
+            }
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error approving ticket: {e}")
 
@@ -96,10 +110,12 @@ async def approve_ticket_route(params: ApproveRejectTicketParams):
 async def reject_ticket_route(params: ApproveRejectTicketParams):
     try:
         res = await reject_ticket(params.ticket_id, params.user_id)
-        return {
-            "status": 1,
-            "data": res,
-        }
+        return FastJSONResponse(
+            {
+                "status": 1,
+                "data": res,
+            }
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error rejecting ticket: {e}")
 
@@ -108,9 +124,11 @@ async def reject_ticket_route(params: ApproveRejectTicketParams):
 async def delete_ticket_route(params: DeleteTicketParams):
     try:
         res = await delete_ticket(params)
-        return {
-            "status": 1,
-            "data": res,
-        }
+        return FastJSONResponse(
+            {
+                "status": 1,
+                "data": res,
+            }
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting ticket: {e}")
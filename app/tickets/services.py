@@ -1,10 +1,18 @@
 # app/tickets/services.py
-import pandas as pd
+import time
+
 from fastapi import HTTPException
 
 from app.config.setting import settings as s
-from app.db.dashboard import GCClient
+from app.db.dashboard import AsyncGCClient, DashboardMode, elapsed_ms, summarize_table
 from app.db.database import MongoClient
+from app.db.export import (
+    ExportColumn,
+    ExportSpec,
+    format_chat_names,
+    format_timestamp_ms,
+)
+from app.db.single_flight import SingleFlight, params_key
 from app.tickets.models import (
     CreateTicketParams,
     DeleteTicket,
@@ -19,7 +27,60 @@ from app.users.services import collection as user_collection
 
 client = MongoClient(s.dev_db if s.is_test else s.prod_db)
 collection = "ticket_records"
-gc_client = GCClient()
+gc_client = AsyncGCClient()
+
+
+# shared by the 3 ticket sheets
+COMMON_TICKET_COLUMNS = [
+    ExportColumn("creator_name", "Creator Name"),
+    ExportColumn("created_timestamp", "Created Time", format_timestamp_ms),
+    ExportColumn("approver_name", "Approver Name"),
+    ExportColumn("status", "Status"),
+    ExportColumn("status_changed_timestamp", "Operation Time", format_timestamp_ms),
+    ExportColumn("chats", "Available Chats", format_chat_names),
+    ExportColumn("success_chats", "Success Chats", format_chat_names),
+    ExportColumn("failed_chats", "Failed Chats", format_chat_names),
+]
+TICKET_EXPORTS = {
+    TicketAction.post_annc: ExportSpec(
+        "post_tickets",
+        "Announcement History",
+        [
+            ExportColumn("ticket_id", "ID"),
+            ExportColumn("annc_type", "Announcement Type"),
+            ExportColumn("content_text", "Content"),
+            ExportColumn("category", "Category"),
+            ExportColumn("language", "Language"),
+            ExportColumn("label", "Label"),
+            *COMMON_TICKET_COLUMNS,
+        ],
+    ),
+    TicketAction.edit_annc: ExportSpec(
+        "edit_tickets",
+        "Edit History",
+        [
+            ExportColumn("ticket_id", "ID"),
+            ExportColumn("old_ticket_id", "Old Ticket ID"),
+            ExportColumn("old_annc_type", "Old Announcement Type"),
+            ExportColumn("old_content_text", "Old Content"),
+            ExportColumn("new_content_text", "New Content"),
+            *COMMON_TICKET_COLUMNS,
+        ],
+    ),
+    TicketAction.delete_annc: ExportSpec(
+        "delete_tickets",
+        "Delete History",
+        [
+            ExportColumn("ticket_id", "ID"),
+            ExportColumn("old_ticket_id", "Old Ticket ID"),
+            ExportColumn("old_annc_type", "Old Announcement Type"),
+            *COMMON_TICKET_COLUMNS,
+        ],
+    ),
+}
+
+# the bot often looks up the same ticket from several handlers at once
+info_flight = SingleFlight("ticket_info")
 
 
 # Below is get endpoints related functions
@@ -29,6 +90,10 @@ async def get_ticket_info(params: TicketInfoParams):
     1. ticket_id will return only one ticket
     2. other params can be independent existing and results will sort in created_timestamp descending order
     """
+    return await info_flight.do(params_key(params), lambda: find_tickets(params))
+
+
+async def find_tickets(params: TicketInfoParams):
     if params.ticket_id:
         res = await client.find_one(collection, {"ticket_id": params.ticket_id})
         return [res] if res else []
@@ -104,11 +169,14 @@ async def create_ticket(params: CreateTicketParams):
     if res:
         raise HTTPException(status_code=400, detail=f"Ticket already created with id: `{ticket.ticket_id}`")
 
-    return await client.insert_one(collection, ticket.model_dump())
+    res = await client.insert_one(collection, ticket.model_dump())
+    info_flight.invalidate()
+    return res
 
 
 async def delete_ticket(params: DeleteTicketParams):
     status = await client.delete_one(collection, query={"ticket_id": params.ticket_id})
+    info_flight.invalidate()
     return {"delete_status": status}
 
 
@@ -147,6 +215,7 @@ async def approve_ticket(ticket_id: str, user_id: str):
         query={"ticket_id": ticket_id},
         update=ticket.model_dump(),
     )
+    info_flight.invalidate()
     return res
 
 
@@ -182,138 +251,33 @@ async def reject_ticket(ticket_id: str, user_id: str):
         query={"ticket_id": ticket_id},
         update=ticket.model_dump(),
     )
+    info_flight.invalidate()
     return res
 
 
-async def update_ticket_dashboard():
+async def update_ticket_dashboard(mode: DashboardMode = DashboardMode.full):
     """
     This function will push the ticket info to the google sheet in the separated 3 sheets.
     and ticket should order by created timestamp in descending order
+    The tickets of the 3 sheets are read with one query and the sheets are written together
+    `summary` mode only returns row count and digest of each sheet instead of the rows
     """
-    outputs = {
-        "post_tickets": None,
-        "edit_tickets": None,
-        "delete_tickets": None,
-    }
-
-    # update post ticket
-    columns_map = {
-        "ticket_id": "ID",
-        "annc_type": "Announcement Type",
-        "content_text": "Content",
-        "category": "Category",
-        "language": "Language",
-        "label": "Label",
-        "creator_name": "Creator Name",
-        "created_timestamp": "Created Time",
-        "approver_name": "Approver Name",
-        "status": "Status",
-        "status_changed_timestamp": "Operation Time",
-        "chats": "Available Chats",
-        "success_chats": "Success Chats",
-        "failed_chats": "Failed Chats",
-    }
-    post_tickets = pd.DataFrame(
-        await client.find_many(collection, query={"action": TicketAction.post_annc}, sort=[("created_timestamp", -1)])
-    )
-    if not post_tickets.empty:
-        post_tickets["created_timestamp"] = pd.to_datetime(post_tickets["created_timestamp"], unit="ms")
-        post_tickets["status_changed_timestamp"] = pd.to_datetime(post_tickets["status_changed_timestamp"], unit="ms")
-        post_tickets["chats"] = post_tickets["chats"].apply(lambda x: ", ".join([c["chat_name"] for c in x]))
-        post_tickets["success_chats"] = post_tickets["success_chats"].apply(
-            lambda x: ", ".join([c["chat_name"] for c in x])
-        )
-        post_tickets["failed_chats"] = post_tickets["failed_chats"].apply(
-            lambda x: ", ".join([c["chat_name"] for c in x])
-        )
-        post_tickets = post_tickets.rename(columns=columns_map).fillna("")
-        post_ws = gc_client.get_ws(name="Announcement History", to_type="ws")
-        post_ws.clear()
-        post_ws.set_dataframe(
-            post_tickets[columns_map.values()].fillna(""),
-            start="A1",
-            copy_index=False,
-            copy_head=True,
-        )
-        outputs["post_tickets"] = post_tickets.to_dict(orient="records")
-
-    # update edit ticket
-    columns_map = {
-        "ticket_id": "ID",
-        "old_ticket_id": "Old Ticket ID",
-        "old_annc_type": "Old Announcement Type",
-        "old_content_text": "Old Content",
-        "new_content_text": "New Content",
-        "creator_name": "Creator Name",
-        "created_timestamp": "Created Time",
-        "approver_name": "Approver Name",
-        "status": "Status",
-        "status_changed_timestamp": "Operation Time",
-        "chats": "Available Chats",
-        "success_chats": "Success Chats",
-        "failed_chats": "Failed Chats",
-    }
-    edit_tickets = pd.DataFrame(
-        await client.find_many(collection, query={"action": TicketAction.edit_annc}, sort=[("created_timestamp", -1)])
-    )
-    if not edit_tickets.empty:
-        edit_tickets["created_timestamp"] = pd.to_datetime(edit_tickets["created_timestamp"], unit="ms")
-        edit_tickets["status_changed_timestamp"] = pd.to_datetime(edit_tickets["status_changed_timestamp"], unit="ms")
-        edit_tickets["chats"] = edit_tickets["chats"].apply(lambda x: ", ".join([c["chat_name"] for c in x]))
-        edit_tickets["success_chats"] = edit_tickets["success_chats"].apply(
-            lambda x: ", ".join([c["chat_name"] for c in x])
-        )
-        edit_tickets["failed_chats"] = edit_tickets["failed_chats"].apply(
-            lambda x: ", ".join([c["chat_name"] for c in x])
-        )
-        edit_tickets = edit_tickets.rename(columns=columns_map).fillna("")
-        edit_ws = gc_client.get_ws(name="Edit History", to_type="ws")
-        edit_ws.clear()
-        edit_ws.set_dataframe(
-            edit_tickets[columns_map.values()].fillna(""),
-            start="A1",
-            copy_index=False,
-            copy_head=True,
-        )
-        outputs["edit_tickets"] = edit_tickets.to_dict(orient="records")
-
-    # update delete ticket
-    columns_map = {
-        "ticket_id": "ID",
-        "old_ticket_id": "Old Ticket ID",
-        "old_annc_type": "Old Announcement Type",
-        "creator_name": "Creator Name",
-        "created_timestamp": "Created Time",
-        "approver_name": "Approver Name",
-        "status": "Status",
-        "status_changed_timestamp": "Operation Time",
-        "chats": "Available Chats",
-        "success_chats": "Success Chats",
-        "failed_chats": "Failed Chats",
-    }
-    delete_tickets = pd.DataFrame(
-        await client.find_many(collection, query={"action": TicketAction.delete_annc}, sort=[("created_timestamp", -1)])
-    )
-    if not delete_tickets.empty:
-        delete_tickets["created_timestamp"] = pd.to_datetime(delete_tickets["created_timestamp"], unit="ms")
-        delete_tickets["status_changed_timestamp"] = pd.to_datetime(
-            delete_tickets["status_changed_timestamp"], unit="ms"
-        )
-        delete_tickets["chats"] = delete_tickets["chats"].apply(lambda x: ", ".join([c["chat_name"] for c in x]))
-        delete_tickets["success_chats"] = delete_tickets["success_chats"].apply(
-            lambda x: ", ".join([c["chat_name"] for c in x])
-        )
-        delete_tickets["failed_chats"] = delete_tickets["failed_chats"].apply(
-            lambda x: ", ".join([c["chat_name"] for c in x])
-        )
-        delete_tickets = delete_tickets.rename(columns=columns_map).fillna("")
-        delete = gc_client.get_ws(name="Delete History", to_type="ws")
-        delete.clear()
-        delete.set_dataframe(
-            delete_tickets[columns_map.values()].fillna(""),
-            start="A1",
-            copy_index=False,
-            copy_head=True,
-        )
-        outputs["delete_tickets"] = delete_tickets.to_dict(orient="records")
+    start = time.perf_counter()
+    documents = {action: [] for action in TICKET_EXPORTS}
+    for document in await client.find_many(
+        collection, query={"action": {"$in": list(TICKET_EXPORTS)}}, sort=[("created_timestamp", -1)]
+    ):
+        documents[document["action"]].append(document)
+
+    outputs, tables = {}, []
+    for action, spec in TICKET_EXPORTS.items():
+        rows = spec.to_rows(documents.pop(action))
+        if rows:
+            ws = await gc_client.get_ws(name=spec.sheet, to_type="ws")
+            tables.append((ws, spec.header, rows, spec.keys))
+        outputs[spec.name] = summarize_table(rows) if mode == DashboardMode.summary else spec.to_records(rows)
+    await gc_client.sync_rows(tables)
+
+    if mode == DashboardMode.summary:
+        outputs["duration_ms"] = elapsed_ms(start)
     return outputs
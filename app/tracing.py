@@ -0,0 +1,267 @@
+import atexit
+import glob
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+import orjson
+
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+TRACE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, **attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "ok"
+        self.start = time.time_ns()
+        self.end = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round((self.end - self.start) / 1e6, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def parse_trace_headers(headers) -> tuple:
+    """
+    Return `(trace_id, parent_span_id)` from the w3c `traceparent` header,
+    a bare 32 hex `X-Request-ID` continues that trace without a parent, otherwise `(None, None)`
+    """
+    match = TRACEPARENT_PATTERN.match((headers.get("traceparent") or "").strip().lower())
+    if match:
+        return match.groups()
+    request_id = (headers.get("X-Request-ID") or "").strip().lower()
+    return (request_id, None) if TRACE_ID_PATTERN.match(request_id) else (None, None)
+
+
+class SpanExporter(ABC):
+    @abstractmethod
+    def export(self, spans: List[dict]):
+        """
+        Called from the exporter thread with a batch of finished spans
+        """
+
+
+class JsonFileExporter(SpanExporter):
+    """
+    One span per line, `python -m app.tracing <trace_id>` renders the timeline of a trace from this file.
+    Once the file would grow past `max_bytes` it is renamed to `<path>.1`, the older files shift up to
+    `<path>.<backups>` and the oldest is dropped, `max_bytes=0` never rotates.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0, backups: int = 1):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def rotate(self):
+        if self.backups < 1:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def export(self, spans: List[dict]):
+        data = b"".join(orjson.dumps(span) + b"\n" for span in spans)
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self.rotate()
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+
+class OTLPExporter(SpanExporter):
+    """
+    Post the spans to an otlp/http collector (`<endpoint>/v1/traces`) in the otlp json encoding
+    """
+
+    def __init__(self, endpoint: str, service_name: str = "announcement-api"):
+        self.url = f"{endpoint.rstrip('/')}/v1/traces"
+        self.service_name = service_name
+
+    @staticmethod
+    def to_otlp(span: dict) -> dict:
+        return {
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "parentSpanId": span["parent_id"] or "",
+            "name": span["name"],
+            "startTimeUnixNano": str(span["start"]),
+            "endTimeUnixNano": str(span["end"]),
+            "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in span["attributes"].items()],
+            "status": {"code": 1 if span["status"] == "ok" else 2},
+        }
+
+    def export(self, spans: List[dict]):
+        body = {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                    "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": [self.to_otlp(s) for s in spans]}],
+                }
+            ]
+        }
+        request = urllib.request.Request(
+            self.url, data=orjson.dumps(body), headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=5):
+            pass
+
+
+class BatchSpanProcessor:
+    """
+    Finished spans are queued by the request handlers and exported in batches by a background thread,
+    so neither the disk nor the collector is waited on in the event loop
+    """
+
+    def __init__(self, exporter: SpanExporter, max_batch_size: int = 512, flush_interval: float = 1.0):
+        self.exporter = exporter
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name="span-exporter", daemon=True)
+        self.thread.start()
+
+    def on_end(self, span: Span):
+        self.queue.put(span.to_dict())
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopped = True
+                    break
+                batch.append(item)
+
+            if batch:
+                try:
+                    self.exporter.export(batch)
+                except Exception:
+                    logging.getLogger("main").exception(f"Failed to export {len(batch)} spans")
+
+    def shutdown(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+
+processor: Optional[BatchSpanProcessor] = None
+
+
+def setup_tracing(exporter: Optional[SpanExporter]):
+    """
+    Start exporting finished spans, spans are still created and propagated without an exporter
+    """
+    global processor
+    if processor is not None:  # already set up by a previous `create_app`
+        return processor
+    if exporter is not None:
+        processor = BatchSpanProcessor(exporter)
+        atexit.register(processor.shutdown)
+    return processor
+
+
+@contextmanager
+def span(name: str, trace_id: str = None, parent_id: str = None, **attributes):
+    """
+    Record the block as a child of the current span, a new trace is started when there is none
+    """
+    parent = current_span.get()
+    if trace_id is None:
+        trace_id, parent_id = (parent.trace_id, parent.span_id) if parent else (secrets.token_hex(16), None)
+
+    item = Span(name, trace_id, parent_id, **attributes)
+    token = current_span.set(item)
+    try:
+        yield item
+    except BaseException as e:
+        item.status = "error"
+        item.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        item.end = time.time_ns()
+        current_span.reset(token)
+        if processor is not None:
+            processor.on_end(item)
+
+
+def render_timeline(spans: List[dict], width: int = 60) -> str:
+    """
+    Flame style text timeline of one trace, children are indented under their parent
+    """
+    if not spans:
+        return ""
+    start = min(s["start"] for s in spans)
+    total = max(max(s["end"] for s in spans) - start, 1)
+    children = {}
+    for s in sorted(spans, key=lambda x: x["start"]):
+        children.setdefault(s["parent_id"], []).append(s)
+    span_ids = {s["span_id"] for s in spans}
+    roots = [s for s in spans if s["parent_id"] not in span_ids]
+
+    lines = []
+
+    def walk(s: dict, depth: int):
+        offset = int((s["start"] - start) / total * width)
+        length = max(int((s["end"] - s["start"]) / total * width), 1)
+        bar = " " * offset + "█" * length
+        label = f"{'  ' * depth}{s['name']}"
+        lines.append(f"{label:<40.40} {bar:<{width}} {s['duration_ms']:>10.3f} ms {s['status']}")
+        for child in children.get(s["span_id"], []):
+            walk(child, depth + 1)
+
+    for root in sorted(roots, key=lambda x: x["start"]):
+        walk(root, 0)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    args = ArgumentParser("Render the timeline of one trace from the json span file")
+    args.add_argument("trace_id", help="trace id, same as the `X-Request-ID` response header")
+    args.add_argument("--file", default=f"{os.path.dirname(os.path.realpath(__file__))}/logs/traces.jsonl")
+    args = args.parse_args()
+
+    # a trace may span the current file and the rotated ones
+    trace = []
+    for path in sorted(glob.glob(f"{glob.escape(args.file)}*")):
+        with open(path, "rb") as f:
+            trace.extend(s for s in map(orjson.loads, f) if s["trace_id"] == args.trace_id)
+    print(render_timeline(trace))
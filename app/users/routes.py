@@ -1,9 +1,12 @@
 # users/routes.py
 from typing import Optional
 
-from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
 
 from app.auth.services import verify_api_key
+from app.dashboard import sync as dashboard_sync
+from app.db.dashboard import DashboardMode
+from app.responses import FastJSONResponse, not_modified
 from app.users.models import (
     DeleteUserParams,
     UpdateUsersInfoParams,
@@ -13,6 +16,7 @@ from app.users.models import (
 from app.users.services import (
     create_user,
     delete_user,
+    get_users_info_etag,
     in_whitelist,
     is_admin,
     list_users_info,
@@ -24,9 +28,11 @@ router = APIRouter(dependencies=[Depends(verify_api_key)])
 
 # below are get routes
 
+
 # list users information by params
 @router.get("/info")
 async def get_users_info(
+    request: Request,
     user_id: Optional[str] = Query(None),
     name: Optional[str] = Query(None),
     admin: Optional[bool] = Query(None),
@@ -35,8 +41,11 @@ async def get_users_info(
 ):
     params = UserInfoParams(user_id=user_id, name=name, admin=admin, whitelist=whitelist, num=num)
     try:
-        res = await list_users_info(params)
-        return {"status": 1, "data": res}
+        etag = await get_users_info_etag()
+        if response := not_modified(request, etag):
+            return response
+        res = await list_users_info(params, version=etag)
+        return FastJSONResponse({"status": 1, "data": res}, headers={"ETag": etag})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting user info: {str(e)}")
 
@@ -45,7 +54,7 @@ async def get_users_info(
 async def in_whitelist_route(user_id: str):
     try:
         res = await in_whitelist(user_id)
-        return {"status": 1, "data": res}
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error checking whitelist: {str(e)}")
 
@@ -54,16 +63,20 @@ async def in_whitelist_route(user_id: str):
 async def is_admin_route(user_id: str):
     try:
         res = await is_admin(user_id)
-        return {"status": 1, "data": res}
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error checking admin: {str(e)}")
 
 
 @router.get("/update_dashboard")
-async def update_dashboard_route():
+async def update_dashboard_route(mode: DashboardMode = DashboardMode.full, background: bool = False):
     try:
-        res = await update_user_dashboard()
-        return {"status": 1, "data": res}
+        job = dashboard_sync.jobs["users"]
+        if background:
+            return FastJSONResponse({"status": 1, "data": job.mark_dirty()})
+        async with job.syncing():
+            res = await update_user_dashboard(mode)
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating dashboard: {str(e)}")
 
@@ -73,7 +86,7 @@ async def update_dashboard_route():
 async def create_user_route(user: User = Body(...)):
     try:
         res = await create_user(user)
-        return {"status": 1, "data": res}
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating user: {str(e)}")
 
@@ -82,7 +95,7 @@ async def create_user_route(user: User = Body(...)):
 async def delete_user_route(params: DeleteUserParams = Body(...)):
     try:
         res = await delete_user(params)
-        return {"status": 1, "data": res}
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting user: {str(e)}")
 
@@ -91,6 +104,6 @@ async def delete_user_route(params: DeleteUserParams = Body(...)):
 async def update_user_info_route(params: UpdateUsersInfoParams = Body(...)):
     try:
         res = await update_users_info(params)
-        return {"status": 1, "data": res}
+        return FastJSONResponse({"status": 1, "data": res})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating permission: {str(e)}")
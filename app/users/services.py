@@ -1,10 +1,13 @@
 # users/services.py
-import pandas as pd
+import time
+
 from fastapi import HTTPException
 
 from app.config.setting import settings as s
-from app.db.dashboard import GCClient
+from app.db.dashboard import AsyncGCClient, DashboardMode, dashboard_output
 from app.db.database import MongoClient
+from app.db.single_flight import SingleFlight, params_key
+from app.responses import make_etag
 from app.users.models import (
     DeleteUserParams,
     UpdateUsersInfoParams,
@@ -14,20 +17,35 @@ from app.users.models import (
 
 client = MongoClient(s.dev_db if s.is_test else s.prod_db)
 collection = "permission"
-gc_client = GCClient()
+gc_client = AsyncGCClient()
+
+# identical `/users/info` reads arriving together are served by one query
+info_flight = SingleFlight("users_info")
+
+
+async def get_users_info_etag() -> str:
+    return make_etag(collection, await client.get_version(collection))
 
 
 async def create_user(user: User):
     results = await client.find_one(collection, query={"user_id": user.user_id})
     if results:
         raise HTTPException(status_code=400, detail=f"User already exists with id `{user.user_id}`")
-    return await client.insert_one(collection, user.model_dump())
+    res = await client.insert_one(collection, user.model_dump())
+    info_flight.invalidate()
+    await client.bump_version(collection)
+    return res
 
 
-async def list_users_info(params: UserInfoParams):
+async def list_users_info(params: UserInfoParams, version: str = None):
+    """
+    `version` is the collection version the caller read, only a query started at that version is joined
+    """
     query = {k: v for k, v in params.model_dump().items() if v and k not in ["num"]}
 
-    return await client.find_many(collection, query=query, limit=params.num)
+    return await info_flight.do(
+        f"{version}:{params_key(params)}", lambda: client.find_many(collection, query=query, limit=params.num)
+    )
 
 
 async def update_users_info(params: UpdateUsersInfoParams):
@@ -39,11 +57,16 @@ async def update_users_info(params: UpdateUsersInfoParams):
     user = User(**user_data)
     user.update(params)
 
-    return await client.update_one(collection, query={"user_id": params.user_id}, update=user.model_dump())
+    res = await client.update_one(collection, query={"user_id": params.user_id}, update=user.model_dump())
+    info_flight.invalidate()
+    await client.bump_version(collection)
+    return res
 
 
 async def delete_user(params: DeleteUserParams):
     status = await client.delete_one(collection, query={"user_id": params.user_id})
+    info_flight.invalidate()
+    await client.bump_version(collection)
     return {"delete_status": status}
 
 
@@ -57,14 +80,19 @@ async def is_admin(user_id: str):
     return user_data.get("admin", False) if user_data else False
 
 
-async def update_user_dashboard():
+async def update_user_dashboard(mode: DashboardMode = DashboardMode.full):
     """
     This function will update the current permission table to the google sheet and only include either admin or whitelist users.
     If both is false, then the user will not be updated to the table
+    `summary` mode only returns row count and digest instead of the rows
     """
-    dashboard = gc_client.get_ws(name="TG User Permission", to_type="ws")
+    import pandas as pd
+
+    start = time.perf_counter()
+    dashboard = await gc_client.get_ws(name="TG User Permission", to_type="ws")
     permissions = pd.DataFrame(
-        await client.find_many(collection, query={"$or": [{"admin": True}, {"whitelist": True}]})
+        await client.find_many(collection, query={"$or": [{"admin": True}, {"whitelist": True}]}),
+        columns=["user_id", "name", "admin", "whitelist", "created_timestamp", "updated_timestamp"],
     )
     permissions["created_timestamp"] = pd.to_datetime(permissions["created_timestamp"], unit="ms")
     permissions["updated_timestamp"] = pd.to_datetime(permissions["updated_timestamp"], unit="ms")
@@ -75,7 +103,6 @@ async def update_user_dashboard():
     ].sort_values("created_timestamp", ascending=False)
 
     permissions.columns = [c.replace("_", " ").title() for c in permissions.columns]
-    dashboard.clear()
-    dashboard.set_dataframe(permissions, start="A1", copy_index=False, copy_head=True)
+    await gc_client.sync_dataframe(dashboard, permissions, keys=["User Id"])
 
-    return permissions.to_dict(orient="records")
+    return dashboard_output(permissions, mode, start)
@@ -14,6 +14,7 @@ from telegram.ext import (
 )
 from utils import get_logger, init_args, save_file
 import datetime
+from app.metrics.loop_monitor import LoopLagMonitor
 from bot.lib.adaptor import AnnouncementClient as ac
 
 load_dotenv()
@@ -148,8 +149,7 @@ class CommandBot:
         return message
 
     def get_category_pattern(self):
-        chats = self.client.get_chat_info(active=True)["data"]
-        category = list(set([j for i in chats for j in i["category"]]))
+        category = self.client.get_chat_facets(active=True)["data"]["category"]
         return "|".join(category) + "|others"
 
     async def start(self, update: Update, context: ContextTypes) -> None:
@@ -170,10 +170,12 @@ class CommandBot:
             return ConversationHandler.END
 
         self.client.update_user_dashboard()
-        res = self.client.update_chats_dashboard(direction="pull")
+        # the keyboard is built from the chats, so edits made on the sheet are pulled before going on
+        self.client.update_chats_dashboard(direction="pull", background="false")
+        facets = self.client.get_chat_facets(active=True)["data"]
 
         # Create category button, two choice per row
-        category = sorted(list(set([j for i in res["data"] for j in i["category"]])))
+        category = sorted(facets["category"])
         name_callback = [(i.replace("_", " ").title(), f"category_{i}") for i in category]
         name_callback.append(("Others", "category_others"))
 
@@ -242,9 +244,9 @@ class CommandBot:
         labels = []
         names = []
 
-        chats = self.client.get_chat_info(active=True)["data"]
-        distinct_labels = list(set([j for i in chats for j in i["label"]]))
-        distinct_names = list(set([i["name"] for i in chats]))
+        facets = self.client.get_chat_facets(active=True)["data"]
+        distinct_labels = facets["label"]
+        distinct_names = facets["name"]
 
         for i in labels_or_names:
             if i in distinct_labels:
@@ -413,17 +415,21 @@ class CommandBot:
         ticket_id = query.data.split("_")[1]
         action = query.data.split("_")[0]
 
-        if action == "approve":
-            self.client.approve_ticket(ticket_id=ticket_id, user_id=str(operator.id))
+        # one trace for the approval, the report and the dashboard update, search the api traces by `trace_id`
+        with self.client.trace() as trace_id:
+            if action == "approve":
+                self.client.approve_ticket(ticket_id=ticket_id, user_id=str(operator.id))
 
-        else:
-            self.client.reject_ticket(ticket_id=ticket_id, user_id=str(operator.id))
+            else:
+                self.client.reject_ticket(ticket_id=ticket_id, user_id=str(operator.id))
 
-        report_message = self.get_report_message(ticket_id)
-        await query.message.edit_text(report_message, parse_mode="HTML")
-        self.client.update_ticket_dashboard()
+            report_message = self.get_report_message(ticket_id)
+            await query.message.edit_text(report_message, parse_mode="HTML")
+            self.client.update_ticket_dashboard()
 
-        self.logger.info(f"Announcement `{ticket_id}` ticket {action} by {operator.full_name}({operator.id})")
+        self.logger.info(
+            f"Announcement `{ticket_id}` ticket {action} by {operator.full_name}({operator.id}), trace_id: {trace_id}"
+        )
         return ConversationHandler.END
     
     def escape_markdown(self, text):
@@ -801,9 +807,24 @@ class CommandBot:
         """
             await update.message.reply_text(message, parse_mode="MarkdownV2")
 
+    async def start_loop_monitor(self, application: Application) -> None:
+        # logs the stack of handlers blocking the loop, e.g. the synchronous api calls
+        # the bots serve no `/metrics`, the lag is logged every minute instead
+        self.loop_monitor = LoopLagMonitor(self.name, logger=self.logger, report_interval=60)
+        self.loop_monitor.start()
+
+    async def stop_loop_monitor(self, application: Application) -> None:
+        self.loop_monitor.stop()
+
     def run(self) -> None:
         self.logger.info(f"Starting {self.name}...")
-        app = Application.builder().token(self.bot_key).build()
+        app = (
+            Application.builder()
+            .token(self.bot_key)
+            .post_init(self.start_loop_monitor)
+            .post_shutdown(self.stop_loop_monitor)
+            .build()
+        )
         
         # Initialize JobQueue
         job_queue = app.job_queue
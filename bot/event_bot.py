@@ -12,6 +12,8 @@ from telegram.ext import (
 from dotenv import load_dotenv
 from utils import get_logger, init_args
 
+from app.metrics.loop_monitor import LoopLagMonitor
+
 
 class EventBot:
     @property
@@ -93,7 +95,8 @@ class EventBot:
         operator = self.handle_operator(update)
 
         # if the chat not in our DB, do nothing
-        self.client.update_chats_dashboard(direction="pull")
+        # the sheet rows are matched by chat name, so they are pulled before the rename
+        self.client.update_chats_dashboard(direction="pull", background="false")
 
         update_ = {
             "chat_id": str(chat.id),
@@ -106,9 +109,24 @@ class EventBot:
         )
         return
 
+    async def start_loop_monitor(self, application: Application) -> None:
+        # logs the stack of handlers blocking the loop, e.g. the synchronous api calls
+        # the bots serve no `/metrics`, the lag is logged every minute instead
+        self.loop_monitor = LoopLagMonitor(self.name, logger=self.logger, report_interval=60)
+        self.loop_monitor.start()
+
+    async def stop_loop_monitor(self, application: Application) -> None:
+        self.loop_monitor.stop()
+
     def run(self):
         self.logger.info("InfoBot is running...")
-        application = Application.builder().token(self.bot_key).build()
+        application = (
+            Application.builder()
+            .token(self.bot_key)
+            .post_init(self.start_loop_monitor)
+            .post_shutdown(self.stop_loop_monitor)
+            .build()
+        )
 
         chat_status_handler = ChatMemberHandler(self.chat_status_update, ChatMemberHandler.MY_CHAT_MEMBER)
         chat_name_update_handler = MessageHandler(filters.StatusUpdate.NEW_CHAT_TITLE, self.chat_title_update)
@@ -1,22 +1,79 @@
+import secrets
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 import requests as req
+from urllib3.util import make_headers
+
+# trace id shared by the api calls of the running bot handler, set by `AnnouncementClient.trace`
+current_trace_id: ContextVar = ContextVar("current_trace_id", default=None)
 
 
 class AnnouncementClient:
     BASE_URL = "http://localhost:8000"
     chats_prefix = "/chats"
+    response_cache_size = 256
 
     def __init__(self, api_key: str, api_secret: str):
         self.base_url = self.BASE_URL
         self.api_key = api_key
         self.api_secret = api_secret
-        self.header = {"X-API-KEY": self.api_key, "X-API-SECRET": self.api_secret}
+        self.header = {
+            "X-API-KEY": self.api_key,
+            "X-API-SECRET": self.api_secret,
+            # ask for every encoding urllib3 can decode here, brotli is only included when installed
+            "Accept-Encoding": make_headers(accept_encoding=True)["accept-encoding"],
+        }
         self.session = req.Session()
 
+        # full request url -> (etag, response json) of GET responses carrying an `ETag`
+        self.response_cache = {}
+
+    @contextmanager
+    def trace(self):
+        """
+        Send the api calls made in the block with one trace id, the api records them under the same trace
+        """
+        token = current_trace_id.set(secrets.token_hex(16))
+        try:
+            yield current_trace_id.get()
+        finally:
+            current_trace_id.reset(token)
+
+    @staticmethod
+    def _trace_headers() -> dict:
+        # w3c trace context, each call is its own span of the current trace
+        trace_id = current_trace_id.get() or secrets.token_hex(16)
+        return {"X-Request-ID": trace_id, "traceparent": f"00-{trace_id}-{secrets.token_hex(8)}-01"}
+
+    def _get_with_cache(self, url: str, params: dict = None):
+        """
+        Revalidate cached GET responses with `If-None-Match`, an unchanged resource comes back as an empty 304
+        """
+        full_url = req.Request("GET", url, params=params).prepare().url
+        cached = self.response_cache.get(full_url)
+        headers = {**self.header, **self._trace_headers()}
+        if cached:
+            headers["If-None-Match"] = cached[0]
+
+        response = self.session.get(full_url, headers=headers)
+        if response.status_code == 304 and cached:
+            return cached[1]
+
+        data = self._handle_response(response)
+        if response.status_code == 200 and "ETag" in response.headers:
+            self.response_cache.pop(full_url, None)
+            if len(self.response_cache) >= self.response_cache_size:
+                self.response_cache.pop(next(iter(self.response_cache)))  # drop the oldest entry
+            self.response_cache[full_url] = (response.headers["ETag"], data)
+        return data
+
     def _request(self, method: str, url: str, params: dict = None):
         if method == "GET":
-            return self._handle_response(self.session.get(url, headers=self.header, params=params))
+            return self._get_with_cache(url, params)
         elif method == "POST":
-            return self._handle_response(self.session.post(url, headers=self.header, json=params))
+            headers = {**self.header, **self._trace_headers()}
+            return self._handle_response(self.session.post(url, headers=headers, json=params))
         else:
             raise ValueError(f"Invalid method: {method}")
 
@@ -50,8 +107,14 @@ class AnnouncementClient:
         url = f"{self.base_url}{self.chats_prefix}/info"
         return self._get(url, params=kwargs)
 
+    def get_chat_facets(self, **kwargs):
+        url = f"{self.base_url}{self.chats_prefix}/facets"
+        return self._get(url, params=kwargs)
+
     def update_chats_dashboard(self, **kwargs):
         url = f"{self.base_url}{self.chats_prefix}/update_dashboard"
+        kwargs.setdefault("mode", "summary")  # the bots only need to know the sync ran
+        kwargs.setdefault("background", "true")  # coalesced with other changes, see `/dashboard/status`
         return self._get(url, params=kwargs)
 
     # user related
@@ -81,6 +144,8 @@ class AnnouncementClient:
 
     def update_user_dashboard(self, **kwargs):
         url = f"{self.base_url}/users/update_dashboard"
+        kwargs.setdefault("mode", "summary")  # the bots only need to know the sync ran
+        kwargs.setdefault("background", "true")  # coalesced with other changes, see `/dashboard/status`
         return self._get(url, params=kwargs)
 
     # ticket related
@@ -106,4 +171,6 @@ class AnnouncementClient:
 
     def update_ticket_dashboard(self, **kwargs):
         url = f"{self.base_url}/tickets/update_dashboard"
+        kwargs.setdefault("mode", "summary")  # the bots only need to know the sync ran
+        kwargs.setdefault("background", "true")  # coalesced with other changes, see `/dashboard/status`
         return self._get(url, params=kwargs)